@@ -36,7 +36,11 @@ Version 3.
 """
 
 import math
+import bisect
+import re
 from collections import defaultdict
+from itertools import accumulate
+from decimal import Decimal, InvalidOperation
 from xml.etree.ElementTree import Element, SubElement
 import xml.dom.minidom as minidom
 
@@ -44,6 +48,96 @@ from dominate import document
 from dominate.tags import *
 
 
+class Instrumentation(object):
+
+    """Zählt wie oft bestimmte Pfade bei der Auswertung durchlaufen wurden,
+    z.B. wie oft bei Schulze die volle Berechnung von p nötig war.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+
+    def count(self, key, n=1):
+        self.counters[key] += n
+
+    def get(self, key):
+        return self.counters[key]
+
+    def reset(self):
+        self.counters.clear()
+
+
+instrumentation = Instrumentation()
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(x):
+        """Anzahl der gesetzten Bits einer nicht-negativen Zahl."""
+        return bin(x).count('1')
+
+
+# Betrag im deutschen Format: Tausenderpunkte, Komma und bis zu zwei
+# Nachkommastellen, z.B. "1.234,5" oder "250"
+euroPattern = re.compile(
+    r'^\s*(\d{1,3}(?:\.\d{3})+|\d+)(?:,(\d{1,2}))?\s*(?:€)?\s*$')
+
+
+def centsFromMatch(m, _str):
+    if m is None:
+        raise ValueError('"%s" ist kein gültiger Betrag' % _str)
+    euros, cents = m.groups()
+    result = int(euros.replace('.', '')) * 100
+    if cents:
+        result += int(cents.ljust(2, '0'))
+    return result
+
+
+def parseCents(_str):
+    """Parst einen Betrag im deutschen Format exakt in Cent.
+
+    Raises:
+        ValueError: Falls _str kein gültiger Betrag ist.
+    """
+    return centsFromMatch(euroPattern.match(_str), _str)
+
+
+def parseCentsColumn(strings):
+    """Parst eine ganze Spalte von Beträgen (wie parseCents) auf einmal,
+    leere Einträge werden zu None.
+    """
+    match = euroPattern.match
+    return [centsFromMatch(match(_str), _str) if _str else None
+            for _str in strings]
+
+
+def decimalToCents(_str):
+    """Wandelt eine Dezimalzahl mit Punkt (z.B. "1000.5" aus der XML Datei)
+    exakt in Cent um.
+
+    Raises:
+        ValueError: Falls _str keine Zahl ist oder mehr als zwei
+            Nachkommastellen hat.
+    """
+    try:
+        value = Decimal(_str.strip()) * 100
+    except InvalidOperation:
+        raise ValueError('%s ist keine Zahl' % _str)
+    if value != value.to_integral_value():
+        raise ValueError('%s hat mehr als zwei Nachkommastellen' % _str)
+    return int(value)
+
+
+def formatCents(cents):
+    """Formatiert einen Betrag in Cent als Euro mit zwei Nachkommastellen
+    (z.B. "1000.50"), ohne Umweg über float.
+    """
+    sign = '-' if cents < 0 else ''
+    euros, rest = divmod(abs(cents), 100)
+    return '%s%d.%02d' % (sign, euros, rest)
+
+
 class MakeVoteException(Exception):
 
     def __init__(self, msg):
@@ -82,7 +176,7 @@ class MedianVote(WeightedVote):
         Args:
             name (string): Name der Initiative / des Fachbereichs
             weight (int): Das Stimmgewicht
-            value (float): Der Betrag für den gestimmt wurde.
+            value (int): Der Betrag für den gestimmt wurde in Cent.
                 None wenn der FB / die Ini nicht abgestimmt hat.
         """
         WeightedVote.__init__(self, name, weight)
@@ -109,6 +203,132 @@ class SchulzeVote(WeightedVote):
         self.ranking = ranking
 
 
+def encodeRanking(ranking):
+    """Kodiert ein Ranking (mit Gleichständen) als eine ganze Zahl.
+
+    Die Optionen werden stabil nach Rangstufe sortiert, die Permutation
+    wird als Lehmer-Code (Index unter allen n! Permutationen) gespeichert,
+    dazu n-1 Bits die angeben ob zwei aufeinanderfolgende Optionen
+    gleich bewertet sind: code = Index * 2^(n-1) + Bits.
+    Rankings mit gleicher Reihenfolge haben den gleichen Code, z.B.
+    [0, 2, 2] und [0, 1, 1]. Der Code kann daher als Schlüssel zum
+    Zusammenfassen gleicher Stimmen verwendet werden.
+
+    Args:
+        ranking (list<int>): Wie in SchulzeVote
+    """
+    n = len(ranking)
+    order = sorted(range(n), key=lambda i: ranking[i])
+    index = 0
+    remaining = list(range(n))
+    for i in order:
+        pos = remaining.index(i)
+        index = index * len(remaining) + pos
+        del remaining[pos]
+    ties = 0
+    for a, b in zip(order, order[1:]):
+        ties = (ties << 1) | (ranking[a] == ranking[b])
+    return (index << max(n - 1, 0)) | ties
+
+
+def decodeRanking(code, n):
+    """Gibt das Ranking zu einem Code von encodeRanking zurück.
+
+    Die Rangstufen sind dabei 0, 1, 2, ... ohne Lücken.
+
+    Args:
+        code (int): Der Code
+        n (int): Anzahl der Optionen
+    """
+    tieBits = max(n - 1, 0)
+    ties = code & ((1 << tieBits) - 1)
+    index = code >> tieBits
+    digits = []
+    for base in range(1, n + 1):
+        index, digit = divmod(index, base)
+        digits.append(digit)
+    remaining = list(range(n))
+    ranking = [0] * n
+    rank = 0
+    for k, digit in enumerate(reversed(digits)):
+        if k > 0 and not (ties >> (tieBits - k)) & 1:
+            rank += 1
+        ranking[remaining.pop(digit)] = rank
+    return ranking
+
+
+def rankingCodeSize(n):
+    """Anzahl der Bytes die für einen Code bei n Optionen nötig sind."""
+    bits = ((math.factorial(n) << max(n - 1, 0)) - 1).bit_length()
+    return max(1, (bits + 7) // 8)
+
+
+def rankingToBytes(ranking):
+    """Kodiert ein Ranking als Bytes fester Länge (rankingCodeSize)."""
+    return encodeRanking(ranking).to_bytes(rankingCodeSize(len(ranking)),
+                                           'little')
+
+
+def rankingFromBytes(data, n):
+    return decodeRanking(int.from_bytes(data, 'little'), n)
+
+
+# Bis zu so vielen Optionen speichert rankingContribution die Beiträge
+# zwischen und 'auto' wählt das Histogramm, es gibt dann höchstens 47293
+# verschiedene Rankings pro n.
+HISTOGRAM_MAX_OPTIONS = 7
+
+# Unter so vielen Stimmen wählt 'auto' computeD, die Bitmasken lohnen sich
+# erst danach (gemessen mit Gewichten 1 bis 2000).
+AUTO_MIN_BALLOTS = 150
+
+# So viele Stimmen prüft 'auto' auf gleiche Rankings
+AUTO_SAMPLE_SIZE = 256
+
+# Wählt für engine / pEngine 'auto' das Verfahren, siehe
+# stura_voting_planner. None für die eingebaute Regel.
+enginePlanner = None
+
+# (n, Code) -> Beitrag des Rankings zu d für n <= HISTOGRAM_MAX_OPTIONS,
+# siehe rankingContribution
+contributionCache = {}
+
+
+def rankingContribution(code, n, ranking=None):
+    """Gibt die Positionen i * n + j zurück, für die das Ranking mit dem
+    gegebenen Code i vor j setzt. Für n <= HISTOGRAM_MAX_OPTIONS wird
+    das Ergebnis zwischengespeichert, so bleibt contributionCache beschränkt.
+
+    Args:
+        ranking (list<int>): Ein Ranking mit diesem Code, falls bekannt
+    """
+    key = (n, code)
+    result = contributionCache.get(key)
+    if result is None:
+        if ranking is None:
+            ranking = decodeRanking(code, n)
+        result = tuple(i * n + j for i in range(n) for j in range(n)
+                       if ranking[i] < ranking[j])
+        if n <= HISTOGRAM_MAX_OPTIONS:
+            contributionCache[key] = result
+    return result
+
+
+def groupRankings(votes):
+    """Fasst gleiche Stimmen zusammen.
+
+    Args:
+        votes (list<SchulzeVote>): Stimmen, ranking darf nicht None sein
+
+    Returns:
+        dict: Code von encodeRanking -> Summe der Gewichte
+    """
+    groups = defaultdict(int)
+    for vote in votes:
+        groups[encodeRanking(vote.ranking)] += vote.weight
+    return groups
+
+
 class PollSkel(object):
 
     """Oberklasse für ein Abstimmungsskellet. Dieses beschreibt
@@ -169,7 +389,7 @@ class MedianSkel(PollSkel):
     def __init__(self, name, percentRequired, allVotes, maxValue):
         """
         Args:
-            maxValue (float): Der abzustimmende Betrag
+            maxValue (int): Der abzustimmende Betrag in Cent
         """
         PollSkel.__init__(self, name, percentRequired, allVotes)
         self.maxValue = maxValue
@@ -177,7 +397,7 @@ class MedianSkel(PollSkel):
     def toXMLTree(self, parent):
         node = PollSkel.toXMLTree(self, parent)
         node.set('type', 'median')
-        node.set('maxValue', str(self.maxValue))
+        node.set('maxValue', formatCents(self.maxValue))
         return node
 
     def emptyPoll(self):
@@ -240,6 +460,8 @@ class Poll(PollSkel):
         PollSkel.__init__(self, skel.name, skel.percentRequired,
                           skel.allVotes)
         self.votes = []
+        # optionales BallotLog aus stura_voting_wal
+        self.log = None
 
     def addVote(self, vote):
         """Fügt eine Abstimmung eines Fachbereichs / Initiative hinzu.
@@ -249,7 +471,12 @@ class Poll(PollSkel):
         Args:
             vote (WeightedVote): Das Vote welches zugefügt werden soll.
         """
+        if self.log is not None:
+            # zuerst ins Log, schlägt das fehl wird die Stimme nicht gezählt
+            self.log.append(self, vote)
         self.votes.append(vote)
+        if self.log is not None:
+            self.log.maybeCompact()
 
 
 class EvalResult(object):
@@ -267,22 +494,96 @@ class EvalResult(object):
         self.actualVotes = actualVotes
 
 
+class MedianCurve(object):
+
+    """Kumulierte Stimmgewichte einer Median-Abstimmung.
+
+    Die Stimmen werden einmal absteigend nach Betrag sortiert, danach
+    kann der genehmigte Betrag für jede beliebige Mehrheit (percentRequired)
+    per binärer Suche in O(log V) bestimmt werden.
+    """
+
+    def __init__(self, sortedVotes):
+        """
+        Args:
+            sortedVotes (list<MedianVote>): Die abgegebenen Stimmen,
+                absteigend nach value sortiert (keine None Werte).
+        """
+        self.values = []
+        self.cumWeights = []
+        self.weightSum = 0
+        for vote in sortedVotes:
+            self.append(vote.value, vote.weight)
+
+    def append(self, value, weight):
+        """Fügt eine Stimme zu, value darf nicht größer als der zuletzt
+        zugefügte Betrag sein.
+        """
+        self.weightSum += weight
+        if self.values and self.values[-1] == value:
+            # gleiche Beträge zusammenfassen
+            self.cumWeights[-1] = self.weightSum
+        else:
+            self.values.append(value)
+            self.cumWeights.append(self.weightSum)
+
+    def requiredVotes(self, percentRequired):
+        return math.floor(self.weightSum * percentRequired)
+
+    def acceptedValue(self, percentRequired):
+        """Gibt den genehmigten Betrag für die gegebene Mehrheit zurück.
+
+        Das ist der größte Betrag, für den mehr als requiredVotes
+        Stimmen (diesen oder einen höheren Betrag) abgegeben wurden.
+        None falls es keinen solchen Betrag gibt.
+
+        Args:
+            percentRequired (float): Wert zwischen 0 und 1
+        """
+        required = self.requiredVotes(percentRequired)
+        pos = bisect.bisect_right(self.cumWeights, required)
+        if pos >= len(self.values):
+            return None
+        return self.values[pos]
+
+    def steps(self):
+        """Gibt die gesamte Tabelle Betrag gegen Mehrheit zurück.
+
+        Liefert eine Liste von Tupeln (lower, upper, value): Für jede
+        Mehrheit percentRequired mit lower <= percentRequired < upper
+        wird value genehmigt.
+        """
+        result = []
+        if self.weightSum <= 0:
+            return result
+        before = 0
+        for value, cum in zip(self.values, self.cumWeights):
+            result.append((before / self.weightSum, cum / self.weightSum,
+                           value))
+            before = cum
+        return result
+
+
 class MedianResult(EvalResult):
 
     """Klasse für ein Median Abstimmungsergebnis.
     """
 
-    def __init__(self, actualVotes, requiredVotes, weightSum, acceptedValue):
+    def __init__(self, actualVotes, requiredVotes, weightSum, acceptedValue,
+                 curve=None):
         """
         Args:
             requiredVotes (int): Anzahl benötigter Stimmen
                 für eine Mehrheit
-            acceptedValue (float): Ergebnis (Höhe)
+            acceptedValue (int): Ergebnis (Höhe in Cent)
+            curve (MedianCurve): Kumulierte Gewichte um das Ergebnis
+                für andere Mehrheiten abzufragen, kann None sein.
         """
         EvalResult.__init__(self, actualVotes)
         self.requiredVotes = requiredVotes
         self.weightSum = weightSum
         self.acceptedValue = acceptedValue
+        self.curve = curve
 
     def htmlOutput(self, doc, poll):
         with doc:
@@ -294,8 +595,24 @@ class MedianResult(EvalResult):
             div(text)
             if poll.allVotes:
                 div('Enthaltungen wurden als Stimme für 0€ gewertet.')
-            with div('Beantragt wurden %.2f€, genehmigt wurden ' % poll.maxValue):
-                b('%.2f€.' % self.acceptedValue)
+            with div('Beantragt wurden %s€, genehmigt wurden ' %
+                     formatCents(poll.maxValue)):
+                b('%s€.' % formatCents(self.acceptedValue))
+            if self.curve is not None:
+                self.curveOutput()
+
+    def curveOutput(self):
+        div('Genehmigter Betrag in Abhängigkeit von der benötigten Mehrheit:')
+        br()
+        with table(border="1"):
+            with tr():
+                th('Benötigte Mehrheit')
+                th('Genehmigter Betrag')
+            for lower, upper, value in self.curve.steps():
+                with tr():
+                    td('ab %.2f%% bis unter %.2f%%' % (lower * 100,
+                                                       upper * 100))
+                    td('%s€' % formatCents(value))
 
 
 class SchulzeResult(EvalResult):
@@ -303,19 +620,73 @@ class SchulzeResult(EvalResult):
     """Klasse für ein Schulze Abstimmungsergebnis.
     """
 
-    def __init__(self, actualVotes, requiredVotes, weightSum, ranks, d, p):
+    def __init__(self, actualVotes, requiredVotes, weightSum, ranks, d, p,
+                 partial=False, poll=None, releaseP=False):
         """
         Args:
             requiredVotes (int): Anzahl benötigter Stimmen
                 für eine Mehrheit
             ranks (?): TODO
+            partial (bool): True falls nur die ersten Gruppen des Rankings
+                berechnet wurden, p ist dann None.
+            poll (SchulzePoll): Falls gesetzt werden p und ranks, falls
+                None, erst beim ersten Zugriff mit dieser Abstimmung
+                berechnet.
+            releaseP (bool): Falls True wird p nicht behalten nachdem
+                ranks daraus berechnet wurde (p wird bei einem späteren
+                Zugriff erneut berechnet).
         """
         EvalResult.__init__(self, actualVotes)
         self.requiredVotes = requiredVotes
         self.weightSum = weightSum
-        self.ranks = ranks
+        self._ranks = ranks
         self.d = d
-        self.p = p
+        self._p = p
+        self.partial = partial
+        self.poll = poll
+        self.releaseP = releaseP
+        # Ergebnis von majorityOrder, False falls noch nicht geprüft
+        self.order = False
+
+    def majorityOrder(self):
+        if self.order is False:
+            self.order = self.poll.majorityOrder(self.d)
+            if self.order is not None:
+                # Mehrheitsrelation ist transitiv, kein Zyklus
+                instrumentation.count('schulze.condorcet')
+        return self.order
+
+    @property
+    def p(self):
+        if self._p is None and self.poll is not None:
+            order = self.majorityOrder()
+            if order is not None:
+                self._p = self.poll.computePFromOrder(self.d, order)
+            else:
+                instrumentation.count('schulze.closure')
+                self._p = self.poll.computePWithEngine(self.d)
+        return self._p
+
+    @property
+    def ranks(self):
+        if self._ranks is None and self.poll is not None:
+            order = self.majorityOrder()
+            if order is not None:
+                # das Ranking ergibt sich ohne p
+                self._ranks = order
+            else:
+                self._ranks = self.poll.rankP(self.p)
+                if self.releaseP:
+                    self._p = None
+        return self._ranks
+
+    def materialize(self):
+        """Berechnet alle noch fehlenden Werte sofort, z.B. bevor das
+        Ergebnis an einen anderen Prozess übergeben wird.
+        """
+        self.ranks
+        self.p
+        return self
 
     def htmlOutput(self, doc, poll):
         with doc:
@@ -327,7 +698,11 @@ class SchulzeResult(EvalResult):
             div(text)
             if poll.allVotes:
                 div('Enthaltungen wurden als Nein-Stimme gewertet.')
-            div('Das folgende Ranking wurde abgestimmt:')
+            if self.partial:
+                div('Berechnet wurden nur die ersten %d Gruppen des Rankings:' %
+                    len(self.ranks))
+            else:
+                div('Das folgende Ranking wurde abgestimmt:')
             with ol():
                 for group in self.ranks:
                     li('Gruppe')
@@ -350,6 +725,131 @@ class SchulzeResult(EvalResult):
                            ((self.d[i][posNo] / self.weightSum) * 100))
 
 
+class CondorcetResult(EvalResult):
+
+    """Ergebnis eines weiteren Condorcet-Verfahrens (Copeland, Minimax,
+    Ranked Pairs), berechnet aus der gleichen Matrix d wie Schulze.
+    """
+
+    def __init__(self, actualVotes, requiredVotes, weightSum, method, ranks,
+                 scores, d):
+        """
+        Args:
+            method (string): Name des Verfahrens für die Ausgabe
+            ranks (list<list<int>>): Ranking im gleichen Format wie
+                SchulzeResult.ranks
+            scores (list): Die Punkte jeder Option in dem Verfahren
+        """
+        EvalResult.__init__(self, actualVotes)
+        self.requiredVotes = requiredVotes
+        self.weightSum = weightSum
+        self.method = method
+        self.ranks = ranks
+        self.scores = scores
+        self.d = d
+
+    def htmlOutput(self, doc, poll):
+        with doc:
+            h2('Abstimmung: "%s" (%s)' % (poll.name, self.method))
+            div('Das folgende Ranking ergibt sich nach %s:' % self.method)
+            with ol():
+                for group in self.ranks:
+                    li('Gruppe')
+                    with ul():
+                        for elem in group:
+                            li('%s (%s)' % (poll.options[elem],
+                                            self.scores[elem]))
+
+
+def groupByScore(scores, reverse=True):
+    """Fasst Optionen mit gleicher Punktzahl zu Gruppen zusammen,
+    sortiert nach Punktzahl (absteigend falls reverse).
+    """
+    groups = defaultdict(list)
+    for i, score in enumerate(scores):
+        groups[score].append(i)
+    return [groups[key] for key in sorted(groups.keys(), reverse=reverse)]
+
+
+def copelandRanking(d):
+    """Copeland: Paarweise Siege minus paarweise Niederlagen, O(n²)."""
+    numChoices = len(d)
+    scores = [0] * numChoices
+    for i in range(numChoices):
+        for j in range(i + 1, numChoices):
+            if d[i][j] > d[j][i]:
+                scores[i] += 1
+                scores[j] -= 1
+            elif d[j][i] > d[i][j]:
+                scores[j] += 1
+                scores[i] -= 1
+    return groupByScore(scores), scores
+
+
+def minimaxRanking(d):
+    """Minimax (winning votes): Die Punkte einer Option sind die Stimmen
+    ihrer stärksten paarweisen Niederlage, weniger ist besser. O(n²).
+    """
+    numChoices = len(d)
+    scores = [0] * numChoices
+    for i in range(numChoices):
+        for j in range(numChoices):
+            if d[j][i] > d[i][j] and d[j][i] > scores[i]:
+                scores[i] = d[j][i]
+    return groupByScore(scores, False), scores
+
+
+def rankedPairsRanking(d):
+    """Ranked Pairs: Die paarweisen Siege werden nach Stärke sortiert
+    (bei Gleichstand weniger Gegenstimmen zuerst) und nacheinander
+    festgelegt, außer sie würden einen Zyklus bilden.
+
+    Die Erreichbarkeit im festgelegten Graphen wird als Bitmaske pro
+    Option mitgeführt, so ist jeder Test auf einen Zyklus O(1) und jede
+    Aktualisierung O(n) Operationen auf Bitmasken. Bei bis zu n(n-1)/2
+    festgelegten Paaren sind das insgesamt O(n³) Operationen auf
+    Bitmasken, dazu O(n² log n) für das Sortieren. Die Punkte sind die
+    Anzahl der Optionen die von einer Option aus erreichbar sind.
+    """
+    numChoices = len(d)
+    pairs = []
+    for i in range(numChoices):
+        for j in range(numChoices):
+            if d[i][j] > d[j][i]:
+                pairs.append((-d[i][j], d[j][i], i, j))
+    pairs.sort()
+    reach = [1 << i for i in range(numChoices)]
+    for _, _, i, j in pairs:
+        if reach[j] >> i & 1:
+            # i ist von j aus erreichbar, i -> j wäre ein Zyklus
+            continue
+        bitI = 1 << i
+        reachJ = reach[j]
+        for x in range(numChoices):
+            if reach[x] & bitI:
+                reach[x] |= reachJ
+    scores = [popcount(r) - 1 for r in reach]
+    return groupByScore(scores), scores
+
+
+# Weitere Verfahren für SchulzePoll.evaluateMethods, Name -> (Titel, Funktion)
+condorcetMethods = {
+    'copeland': ('Copeland', copelandRanking),
+    'minimax': ('Minimax', minimaxRanking),
+    'rankedpairs': ('Ranked Pairs', rankedPairsRanking),
+}
+
+
+def registerCondorcetMethod(name, title, func):
+    """Registriert ein weiteres Verfahren für evaluateMethods.
+
+    Args:
+        func (function): Bekommt die Matrix d und gibt ein Paar
+            (ranks, scores) zurück.
+    """
+    condorcetMethods[name] = (title, func)
+
+
 class MedianPoll(Poll):
 
     """Klasse für eine Median-Abstimmung.
@@ -382,41 +882,75 @@ class MedianPoll(Poll):
                 # es ist None --> wenn allVotes aktiv mit 0 zufügen
                 # ansonsten ignorieren
                 if self.allVotes:
-                    actualVotes.append(MedianVote(vote.name, vote.weight, 0.0))
+                    actualVotes.append(MedianVote(vote.name, vote.weight, 0))
                     weightSum += vote.weight
-        requiredVotes = math.floor(weightSum * self.percentRequired)
-        acceptedValue = None
-        weightSoFar = 0
-        keyFunc = lambda item: item.value
-        actualVotes.sort(key=keyFunc, reverse=True)
-        for vote in actualVotes:
-            weightSoFar += vote.weight
-            if weightSoFar > requiredVotes:
-                acceptedValue = vote.value
-                break
-        return MedianResult(actualVotes, requiredVotes, weightSum, acceptedValue)
+        # stabil, bei gleichem Betrag bleibt die Reihenfolge erhalten
+        actualVotes.sort(key=lambda item: item.value, reverse=True)
+        curve = MedianCurve(actualVotes)
+        requiredVotes = curve.requiredVotes(self.percentRequired)
+        acceptedValue = curve.acceptedValue(self.percentRequired)
+        return MedianResult(actualVotes, requiredVotes, weightSum,
+                            acceptedValue, curve)
 
     def makeVote(self, voter, _str):
         val = None
         if _str:
             try:
-                val = self.parseFloat(_str)
+                val = parseCents(_str)
             except ValueError as e:
                 raise MakeVoteException(
                     ('Eingegebener Wert von %s ist kein gültiger Zahlenwert: ' %
                      voter.name) + str(e))
         return MedianVote(voter.name, voter.weight, val)
 
-    def parseFloat(self, _str):
-        result = ''
-        for c in _str:
-            if c == ',':
-                result += '.'
-            elif c == '.':
-                result += ','
-            else:
-                result += c
-        return float(result)
+
+def evaluateMedianBatch(polls):
+    """Wertet viele Median-Abstimmungen (z.B. alle Finanzanträge einer
+    Sitzung aus readTable) gemeinsam aus.
+
+    Anders als MedianPoll.evaluate werden keine Vote Objekte sortiert:
+    Pro Abstimmung werden die Gewichte gleicher Beträge in einem
+    Dictionary summiert und nur die verschiedenen Beträge sortiert, die
+    kumulierten Gewichte entstehen dann mit itertools.accumulate.
+    Enthaltungen werden wie in MedianPoll.evaluate behandelt.
+
+    Returns:
+        Eine Liste von MedianResult in der Reihenfolge von polls,
+        actualVotes ist dabei None.
+    """
+    return [medianResultFromValues(poll, ((vote.value, vote.weight)
+                                          for vote in poll.votes))
+            for poll in polls]
+
+
+def medianResultFromValues(poll, values):
+    """Wertet eine Median-Abstimmung wie evaluateMedianBatch aus, die
+    Stimmen werden aber als Paare (Betrag, Gewicht) übergeben, Betrag
+    None ist eine Enthaltung. So müssen keine MedianVote Objekte erzeugt
+    werden.
+
+    Args:
+        poll (MedianPoll): Die Abstimmung, ihre Stimmen werden ignoriert
+        values (iterable): Paare (Betrag, Gewicht)
+
+    Returns:
+        MedianResult: actualVotes ist dabei None
+    """
+    sums = defaultdict(int)
+    for value, weight in values:
+        if value is None:
+            if not poll.allVotes:
+                continue
+            value = 0
+        sums[value] += weight
+    curve = MedianCurve([])
+    curve.values = sorted(sums, reverse=True)
+    curve.cumWeights = list(accumulate(sums[v] for v in curve.values))
+    if curve.cumWeights:
+        curve.weightSum = curve.cumWeights[-1]
+    return MedianResult(None, curve.requiredVotes(poll.percentRequired),
+                        curve.weightSum,
+                        curve.acceptedValue(poll.percentRequired), curve)
 
 
 class SchulzePoll(Poll):
@@ -432,28 +966,111 @@ class SchulzePoll(Poll):
         """
         Poll.__init__(self, skel)
         self.options = skel.options
+        self.engine = 'auto'
+        self.pEngine = 'auto'
 
-    def evaluate(self):
+    # Verfahren zur Berechnung von d, auswählbar über engine
+    dEngines = {'python': 'computeD', 'bitset': 'computeDBitset',
+                'histogram': 'computeDHistogram', 'auto': 'computeDAuto'}
+
+    # Verfahren zur Berechnung von p, auswählbar über pEngine
+    pEngines = {'python': 'computeP', 'parallel': 'computePParallel',
+                'auto': 'computePAuto'}
+
+    def evaluate(self, topK=None):
+        """Wertet das Schulze-Verfahren aus.
+
+        Args:
+            topK (int): Falls gesetzt werden nur die ersten topK Gruppen
+                des Rankings berechnet (topK=1 für den Gewinner), ohne
+                die volle Matrix p. Das Ergebnis ist dann als partial
+                markiert.
+        """
+        actualVotes, weightSum = self.collectVotes()
+        d = self.computeDWithEngine(actualVotes)
+        return self.resultFromD(actualVotes, weightSum, d, topK)
+
+    def evaluateMethods(self, methods=None):
+        """Berechnet d einmal und wertet die Abstimmung damit nach
+        mehreren Verfahren aus.
+
+        Args:
+            methods (list<string>): Namen der Verfahren, 'schulze' oder ein
+                in condorcetMethods registriertes Verfahren. None für alle.
+
+        Returns:
+            Eine Liste von Paaren (Name, EvalResult) in der Reihenfolge
+            von methods.
+        """
+        if methods is None:
+            methods = ['schulze'] + sorted(condorcetMethods.keys())
+        actualVotes, weightSum = self.collectVotes()
+        d = self.computeDWithEngine(actualVotes)
+        requiredVotes = math.floor(weightSum * self.percentRequired)
+        result = []
+        for name in methods:
+            if name == 'schulze':
+                r = self.resultFromD(actualVotes, weightSum, d)
+            elif name in condorcetMethods:
+                title, func = condorcetMethods[name]
+                ranks, scores = func(d)
+                r = CondorcetResult(actualVotes, requiredVotes, weightSum,
+                                    title, ranks, scores, d)
+            else:
+                raise ValueError('Unbekanntes Verfahren "%s"' % name)
+            result.append((name, r))
+        return result
+
+    def collectVotes(self):
+        """Gibt die gewerteten Stimmen und die Summe ihrer Gewichte zurück.
+        """
         actualVotes = []
         weightSum = 0
         for vote in self.votes:
-            if vote.ranking is not None:
-                # einfach zufügen
+            vote = self.actualVote(vote)
+            if vote is not None:
                 actualVotes.append(vote)
                 weightSum += vote.weight
-            else:
-                # es ist None --> als Nein Stimme zählen
-                # (Annahme: Nein ist letzte Option)
-                if self.allVotes:
-                    r = [1] * (len(self.options) - 1)
-                    r.append(0)
-                    actualVotes.append(SchulzeVote(vote.name, vote.weight, r))
-                    weightSum += vote.weight
+        return actualVotes, weightSum
+
+    def actualVote(self, vote):
+        """Gibt die Stimme zurück wie sie in die Auswertung eingeht.
+
+        None wenn die Stimme ignoriert wird.
+        """
+        if vote.ranking is not None:
+            # einfach zufügen
+            return vote
+        # es ist None --> als Nein Stimme zählen
+        # (Annahme: Nein ist letzte Option)
+        if self.allVotes:
+            r = [1] * (len(self.options) - 1)
+            r.append(0)
+            return SchulzeVote(vote.name, vote.weight, r)
+        return None
+
+    def resultFromD(self, actualVotes, weightSum, d, topK=None):
+        """Berechnet das Ergebnis aus der bereits bestimmten Matrix d.
+
+        Args:
+            actualVotes (list<SchulzeVote>): Die gewerteten Stimmen
+            weightSum (int): Summe der Gewichte der gewerteten Stimmen
+            d (Matrix von int): Die Matrix d
+            topK (int): Siehe evaluate
+        """
         requiredVotes = math.floor(weightSum * self.percentRequired)
-        d = self.computeD(actualVotes)
-        p = self.computeP(d)
-        ranks = self.rankP(p)
-        return SchulzeResult(actualVotes, requiredVotes, weightSum, ranks, d, p)
+        if topK is None:
+            # p und ranks werden erst bei Bedarf berechnet
+            return SchulzeResult(actualVotes, requiredVotes, weightSum, None,
+                                 d, None, poll=self)
+        ranks = self.majorityOrder(d)
+        if ranks is not None:
+            instrumentation.count('schulze.condorcet')
+            ranks = ranks[:topK]
+        else:
+            ranks = self.topGroups(d, topK)
+        return SchulzeResult(actualVotes, requiredVotes, weightSum, ranks, d,
+                             None, True)
 
     def computeD(self, votes):
         """Berechnet die Matrix d wie sie hier beschrieben ist:
@@ -472,6 +1089,159 @@ class SchulzePoll(Poll):
                         d[j][i] += w
         return d
 
+    def computeDWithEngine(self, votes):
+        """Berechnet d mit dem in engine ausgewählten Verfahren.
+        """
+        if self.engine not in self.dEngines:
+            raise ValueError('Unbekanntes Verfahren "%s"' % self.engine)
+        return getattr(self, self.dEngines[self.engine])(votes)
+
+    def computeDBitset(self, votes):
+        """Berechnet die gleiche Matrix d wie computeD, aber mit Bitmasken.
+
+        Gleiche Rankings werden zusammengefasst, jedes verschiedene Ranking
+        bekommt ein Bit. Pro Option und Rangstufe gibt es eine Bitmaske der
+        Rankings bei denen die Option auf dieser Stufe steht, daraus ergibt
+        sich für jedes Paar i, j über AND / OR die Maske der Rankings bei
+        denen i vor j liegt. Die Gewichte werden nach Bits zerlegt: für
+        jedes Bit b gibt es eine Maske der Rankings deren Gewicht b gesetzt
+        hat, d[i][j] ist dann die Summe von 2^b * popcount über alle b.
+        Der Aufwand hängt so nur von der Größe der Gewichte ab, nicht von
+        der Anzahl verschiedener Gewichte.
+        """
+        numChoices = len(self.options)
+        d = [[0 for j in range(numChoices)] for i in range(numChoices)]
+        rankings = defaultdict(int)
+        for vote in votes:
+            rankings[tuple(vote.ranking)] += vote.weight
+        if not rankings:
+            return d
+        if min(rankings.values()) < 0:
+            # die Zerlegung in Bits geht nur für nicht-negative Gewichte
+            return self.computeD(votes)
+        levels = sorted(set(v for ranking in rankings for v in ranking))
+        levelIndex = {v: t for t, v in enumerate(levels)}
+        numLevels = len(levels)
+        numBytes = (len(rankings) + 7) // 8
+        buffers = [[None] * numLevels for i in range(numChoices)]
+        numBits = max(rankings.values()).bit_length()
+        weightBuffers = [bytearray(numBytes) for b in range(numBits)]
+        for pos, (ranking, w) in enumerate(rankings.items()):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            for i in range(numChoices):
+                t = levelIndex[ranking[i]]
+                buf = buffers[i][t]
+                if buf is None:
+                    buf = buffers[i][t] = bytearray(numBytes)
+                buf[byte] |= bit
+            b = 0
+            while w:
+                if w & 1:
+                    weightBuffers[b][byte] |= bit
+                w >>= 1
+                b += 1
+        at = [[0 if buf is None else int.from_bytes(buf, 'little')
+               for buf in row] for row in buffers]
+        weightMasks = [(b, int.from_bytes(buf, 'little'))
+                       for b, buf in enumerate(weightBuffers)]
+        weightMasks = [(b, mask) for b, mask in weightMasks if mask]
+        # below[j][t]: Rankings bei denen j schlechter als Stufe t ist
+        below = []
+        for j in range(numChoices):
+            masks = [0] * numLevels
+            acc = 0
+            for t in range(numLevels - 1, -1, -1):
+                masks[t] = acc
+                acc |= at[j][t]
+            below.append(masks)
+        for i in range(numChoices):
+            levelsI = [(t, mask) for t, mask in enumerate(at[i]) if mask]
+            di = d[i]
+            for j in range(numChoices):
+                if i == j:
+                    continue
+                belowJ = below[j]
+                better = 0
+                for t, mask in levelsI:
+                    better |= mask & belowJ[t]
+                if better:
+                    di[j] = sum(popcount(better & mask) << b
+                                for b, mask in weightMasks)
+        return d
+
+    def computeDHistogram(self, votes):
+        """Berechnet die gleiche Matrix d wie computeD über ein Histogramm
+        der Rankings.
+
+        Pro Stimme wird nur das Gewicht ihres Rankings aufsummiert, danach
+        wird jedes verschiedene Ranking (über encodeRanking zusammengefasst)
+        einmal mit seinem Beitrag zu d aus rankingContribution verrechnet.
+        Das lohnt sich nur wenn sich viele Rankings wiederholen, bei
+        überwiegend verschiedenen Rankings ist computeDBitset schneller.
+        """
+        numChoices = len(self.options)
+        rankings = defaultdict(int)
+        for vote in votes:
+            rankings[tuple(vote.ranking)] += vote.weight
+        histogram = defaultdict(int)
+        examples = {}
+        for ranking, w in rankings.items():
+            code = encodeRanking(ranking)
+            histogram[code] += w
+            examples[code] = ranking
+        flat = [0] * (numChoices * numChoices)
+        for code, w in histogram.items():
+            for k in rankingContribution(code, numChoices, examples[code]):
+                flat[k] += w
+        return [flat[i * numChoices:(i + 1) * numChoices]
+                for i in range(numChoices)]
+
+    def computeDAuto(self, votes):
+        """Wählt das Verfahren für d über enginePlanner falls gesetzt,
+        sonst: computeD für wenige Stimmen, das Histogramm für bis zu
+        HISTOGRAM_MAX_OPTIONS Optionen wenn sich die Rankings in den ersten
+        AUTO_SAMPLE_SIZE Stimmen im Schnitt mindestens viermal wiederholen
+        und sonst computeDBitset.
+        """
+        numChoices = len(self.options)
+        if enginePlanner is not None:
+            engine = enginePlanner.chooseD(numChoices, len(votes))
+        elif len(votes) < AUTO_MIN_BALLOTS:
+            engine = 'python'
+        elif numChoices <= HISTOGRAM_MAX_OPTIONS and \
+                4 * len(set(tuple(v.ranking)
+                            for v in votes[:AUTO_SAMPLE_SIZE])) <= \
+                min(len(votes), AUTO_SAMPLE_SIZE):
+            engine = 'histogram'
+        else:
+            engine = 'bitset'
+        instrumentation.count('planner.d.' + engine)
+        return getattr(self, self.dEngines[engine])(votes)
+
+    def computePWithEngine(self, d):
+        """Berechnet p mit dem in pEngine ausgewählten Verfahren.
+        """
+        if self.pEngine not in self.pEngines:
+            raise ValueError('Unbekanntes Verfahren "%s"' % self.pEngine)
+        return getattr(self, self.pEngines[self.pEngine])(d)
+
+    def computePAuto(self, d):
+        """Wählt das Verfahren für p über enginePlanner falls gesetzt,
+        sonst immer computeP.
+        """
+        engine = 'python'
+        if enginePlanner is not None:
+            engine = enginePlanner.chooseP(len(self.options))
+        instrumentation.count('planner.p.' + engine)
+        return getattr(self, self.pEngines[engine])(d)
+
+    def computePParallel(self, d):
+        """Berechnet p mit einem geblockten Floyd-Warshall auf allen
+        Prozessoren, siehe stura_voting_parallel.
+        """
+        import stura_voting_parallel
+        return stura_voting_parallel.parallelComputeP(d)
+
     def computeP(self, d):
         """Berechnet die Matrix p, Verfahren wie hier
         <http://de.wikipedia.org/wiki/Schulze-Methode#Implementierung>
@@ -498,6 +1268,177 @@ class SchulzePoll(Poll):
                                 p[j][k] = max(p[j][k], min(p[j][i], p[i][k]))
         return p
 
+    def majorityOrder(self, d):
+        """Prüft in O(n²) ob die paarweise Mehrheitsrelation aus d
+        transitiv ist, d.h. ob sich die Optionen so in Gruppen einteilen
+        lassen, dass jede Option jede Option einer späteren Gruppe
+        schlägt und innerhalb einer Gruppe keine Option eine andere
+        schlägt.
+
+        In diesem Fall ist das Ranking genau diese Gruppeneinteilung und
+        wird im selben Format wie von rankP zurückgegeben, ansonsten None.
+
+        Args:
+            d (Matrix von int): Die Matrix d
+        """
+        numChoices = len(self.options)
+        wins = [0] * numChoices
+        for i in range(numChoices):
+            for j in range(i + 1, numChoices):
+                if d[i][j] > d[j][i]:
+                    wins[i] += 1
+                elif d[j][i] > d[i][j]:
+                    wins[j] += 1
+        groups = defaultdict(list)
+        for i in range(numChoices):
+            groups[wins[i]].append(i)
+        keys = sorted(groups.keys(), reverse=True)
+        # in einer transitiven Relation schlägt jede Option genau alle
+        # Optionen der späteren Gruppen
+        below = numChoices
+        for key in keys:
+            below -= len(groups[key])
+            if key != below:
+                return None
+        groupOf = [0] * numChoices
+        for g, key in enumerate(keys):
+            for i in groups[key]:
+                groupOf[i] = g
+        for i in range(numChoices):
+            for j in range(numChoices):
+                if groupOf[i] < groupOf[j] and not d[i][j] > d[j][i]:
+                    return None
+        return [groups[key] for key in keys]
+
+    def computePFromOrder(self, d, ranks):
+        """Berechnet p für eine transitive Mehrheitsrelation.
+
+        Da Pfade nur von einer Gruppe zu späteren Gruppen führen, werden
+        die stärksten Pfade in umgekehrter Reihenfolge der Gruppen
+        berechnet (längste Pfade in einem azyklischen Graphen). Das
+        Ergebnis ist identisch mit computeP.
+
+        Args:
+            d (Matrix von int): Die Matrix d
+            ranks (list<list<int>>): Ergebnis von majorityOrder
+        """
+        numChoices = len(self.options)
+        p = [[0 for j in range(numChoices)] for i in range(numChoices)]
+        later = []
+        for group in reversed(ranks):
+            for i in group:
+                di = d[i]
+                pi = p[i]
+                for j in later:
+                    best = di[j]
+                    for k in later:
+                        # nur echte Zwischenschritte, p[k][j] ist 0 falls
+                        # k nicht vor j liegt
+                        pkj = p[k][j]
+                        if pkj > best and di[k] > best:
+                            best = min(di[k], pkj)
+                    pi[j] = best
+            later.extend(group)
+        return p
+
+    def widestPaths(self, d, source, reverse=False):
+        """Berechnet eine Zeile von p (die stärksten Pfade ausgehend von
+        source) mit einem modifizierten Dijkstra in O(n²).
+
+        Args:
+            d (Matrix von int): Die Matrix d
+            source (int): Die Option von der die Pfade ausgehen
+            reverse (bool): Falls True werden stattdessen die stärksten
+                Pfade zu source berechnet, also die Spalte von p.
+        """
+        instrumentation.count('schulze.widestPath')
+        numChoices = len(self.options)
+        width = [0] * numChoices
+        done = [False] * numChoices
+        done[source] = True
+        u = source
+        uWidth = None
+        while u is not None:
+            for j in range(numChoices):
+                if done[j]:
+                    continue
+                if reverse:
+                    strength, other = d[j][u], d[u][j]
+                else:
+                    strength, other = d[u][j], d[j][u]
+                if strength > other:
+                    if uWidth is not None:
+                        strength = min(strength, uWidth)
+                    if strength > width[j]:
+                        width[j] = strength
+            u = None
+            best = 0
+            for j in range(numChoices):
+                if not done[j] and width[j] > best:
+                    u, best = j, width[j]
+            if u is not None:
+                done[u] = True
+                uWidth = best
+        return width
+
+    def topGroups(self, d, topK):
+        """Berechnet die ersten topK Gruppen des Rankings so wie sie rankP
+        liefern würde, ohne die volle Matrix p zu berechnen.
+
+        Für einzelne Optionen werden Zeile und Spalte von p mit widestPaths
+        berechnet. Schlägt y die Option x, so hat y mehr Siege als x.
+        Ausgehend von einer beliebigen Option wird daher solange zu einer
+        Option gewechselt die die aktuelle schlägt, bis diese ungeschlagen
+        ist. Die nächste Gruppe besteht dann aus den ungeschlagenen
+        Optionen mit den meisten Siegen, das sind die aktuelle Option und
+        die Optionen mit Gleichstand zu ihr.
+
+        Args:
+            d (Matrix von int): Die Matrix d
+            topK (int): Anzahl der zu berechnenden Gruppen
+        """
+        numChoices = len(self.options)
+        rows = {}
+        cols = {}
+
+        def compute(x):
+            if x not in rows:
+                rows[x] = self.widestPaths(d, x)
+                cols[x] = self.widestPaths(d, x, True)
+
+        result = []
+        remaining = list(range(numChoices))
+        while remaining and len(result) < topK:
+            x = remaining[0]
+            compute(x)
+            beaten = True
+            while beaten:
+                beaten = False
+                for y in remaining:
+                    if cols[x][y] > rows[x][y]:
+                        x = y
+                        compute(x)
+                        beaten = True
+                        break
+            candidates = [y for y in remaining
+                          if y == x or rows[x][y] == cols[x][y]]
+            group = []
+            maxWins = -1
+            for y in candidates:
+                compute(y)
+                if any(cols[y][z] > rows[y][z] for z in remaining):
+                    continue
+                wins = sum(1 for z in range(numChoices)
+                           if rows[y][z] > cols[y][z])
+                if wins > maxWins:
+                    group = [y]
+                    maxWins = wins
+                elif wins == maxWins:
+                    group.append(y)
+            result.append(group)
+            remaining = [y for y in remaining if y not in group]
+        return result
+
     def rankP(self, p):
         """Sortiert die Matrix p, implementiert wie _rank_p hier
         <https://github.com/mgp/schulze-method/blob/master/schulze.py>
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_archive.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Archiv vergangener Sitzungen in einer SQLite Datenbank.
+
+Eine Sitzung (Abstimmende, Abstimmungen, Stimmen und Ergebnisse) wird
+in einer Transaktion mit executemany gespeichert und kann später ohne
+die ursprünglichen Dateien wieder als Poll Objekte geladen werden.
+
+Beispiel:
+    archive = Archive('archiv.sqlite')
+    sessionId = archive.ingest(title, voters, polls, results)
+    archive.medianPollsAbstained('Fachbereich Informatik', 500000)
+"""
+
+import json
+import sqlite3
+
+from stura_voting import *
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS voters (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    weight INTEGER NOT NULL,
+    PRIMARY KEY (session_id, name)
+);
+CREATE INDEX IF NOT EXISTS voters_name ON voters(name);
+CREATE TABLE IF NOT EXISTS polls (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    percent REAL NOT NULL,
+    all_votes INTEGER NOT NULL,
+    max_value INTEGER,
+    options TEXT
+);
+CREATE INDEX IF NOT EXISTS polls_session ON polls(session_id);
+CREATE INDEX IF NOT EXISTS polls_max_value ON polls(type, max_value);
+CREATE TABLE IF NOT EXISTS ballots (
+    session_id INTEGER NOT NULL,
+    poll_id INTEGER NOT NULL REFERENCES polls(id),
+    voter TEXT NOT NULL,
+    weight INTEGER NOT NULL,
+    value INTEGER,
+    ranking TEXT
+);
+CREATE INDEX IF NOT EXISTS ballots_poll ON ballots(poll_id);
+CREATE INDEX IF NOT EXISTS ballots_voter ON ballots(voter, poll_id);
+CREATE INDEX IF NOT EXISTS ballots_session ON ballots(session_id);
+CREATE TABLE IF NOT EXISTS results (
+    poll_id INTEGER PRIMARY KEY REFERENCES polls(id),
+    required_votes INTEGER NOT NULL,
+    weight_sum INTEGER NOT NULL,
+    accepted_value INTEGER,
+    ranks TEXT,
+    d TEXT
+);
+'''
+
+
+class Archive(object):
+
+    """SQLite Archiv für Sitzungen."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (string): Pfad der Datenbank, ':memory:' für ein Archiv
+                im Speicher
+        """
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, title, voters, polls, results=None, date=None):
+        """Speichert eine Sitzung in einer Transaktion.
+
+        Args:
+            title (string): Titel der Sitzung
+            voters (list<WeightedVote>): Die Abstimmenden
+            polls (list<Poll>): Die Abstimmungen mit Stimmen, z.B. von
+                readTable
+            results (list<EvalResult>): Die Ergebnisse in der Reihenfolge
+                von polls, None falls sie nicht gespeichert werden sollen.
+            date (string): z.B. '2015-06-24'
+
+        Returns:
+            Die Id der neuen Sitzung.
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO sessions (title, date) VALUES (?, ?)',
+                (title, date))
+            sessionId = cur.lastrowid
+            self.conn.executemany(
+                'INSERT INTO voters (session_id, position, name, weight) '
+                'VALUES (?, ?, ?, ?)',
+                ((sessionId, i, v.name, v.weight)
+                 for i, v in enumerate(voters)))
+            pollIds = []
+            for i, poll in enumerate(polls):
+                if isinstance(poll, SchulzePoll):
+                    row = ('schulze', None, json.dumps(poll.options))
+                else:
+                    row = ('median', poll.maxValue, None)
+                cur = self.conn.execute(
+                    'INSERT INTO polls (session_id, position, type, name, '
+                    'percent, all_votes, max_value, options) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (sessionId, i, row[0], poll.name, poll.percentRequired,
+                     int(bool(poll.allVotes)), row[1], row[2]))
+                pollIds.append(cur.lastrowid)
+            self.conn.executemany(
+                'INSERT INTO ballots (session_id, poll_id, voter, weight, '
+                'value, ranking) VALUES (?, ?, ?, ?, ?, ?)',
+                self.ballotRows(sessionId, pollIds, polls))
+            if results is not None:
+                self.conn.executemany(
+                    'INSERT INTO results (poll_id, required_votes, '
+                    'weight_sum, accepted_value, ranks, d) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    self.resultRows(pollIds, results))
+        return sessionId
+
+    def ballotRows(self, sessionId, pollIds, polls):
+        for pollId, poll in zip(pollIds, polls):
+            for vote in poll.votes:
+                if isinstance(vote, SchulzeVote):
+                    ranking = None
+                    if vote.ranking is not None:
+                        ranking = ' '.join(str(r) for r in vote.ranking)
+                    yield (sessionId, pollId, vote.name, vote.weight, None,
+                           ranking)
+                else:
+                    yield (sessionId, pollId, vote.name, vote.weight,
+                           vote.value, None)
+
+    def resultRows(self, pollIds, results):
+        for pollId, r in zip(pollIds, results):
+            if isinstance(r, SchulzeResult):
+                yield (pollId, r.requiredVotes, r.weightSum, None,
+                       json.dumps(r.ranks), json.dumps(r.d))
+            else:
+                yield (pollId, r.requiredVotes, r.weightSum, r.acceptedValue,
+                       None, None)
+
+    def sessions(self):
+        """Gibt alle Sitzungen als Liste von (id, Titel, Datum) zurück."""
+        return self.conn.execute(
+            'SELECT id, title, date FROM sessions ORDER BY id').fetchall()
+
+    def loadVoters(self, sessionId):
+        rows = self.conn.execute(
+            'SELECT name, weight FROM voters WHERE session_id = ? '
+            'ORDER BY position', (sessionId,))
+        return [WeightedVote(name, weight) for name, weight in rows]
+
+    def loadSkels(self, sessionId):
+        """Gibt Paare (Poll-Id, PollSkel) einer Sitzung zurück."""
+        rows = self.conn.execute(
+            'SELECT id, type, name, percent, all_votes, max_value, options '
+            'FROM polls WHERE session_id = ? ORDER BY position',
+            (sessionId,))
+        result = []
+        for pollId, _type, name, percent, allVotes, maxValue, options in rows:
+            if _type == 'schulze':
+                skel = SchulzeSkel(name, percent, bool(allVotes),
+                                   json.loads(options))
+            else:
+                skel = MedianSkel(name, percent, bool(allVotes), maxValue)
+            result.append((pollId, skel))
+        return result
+
+    def load(self, sessionId):
+        """Lädt eine Sitzung.
+
+        Returns:
+            (voters, polls): Die Abstimmenden und die Abstimmungen mit
+            allen Stimmen, wie sie von parseVoters und readTable kämen.
+        """
+        voters = self.loadVoters(sessionId)
+        polls = []
+        for pollId, skel in self.loadSkels(sessionId):
+            poll = skel.emptyPoll()
+            rows = self.conn.execute(
+                'SELECT voter, weight, value, ranking FROM ballots '
+                'WHERE poll_id = ? ORDER BY rowid', (pollId,))
+            schulze = isinstance(poll, SchulzePoll)
+            for voter, weight, value, ranking in rows:
+                if schulze:
+                    if ranking is not None:
+                        ranking = [int(r) for r in ranking.split(' ')]
+                    poll.addVote(SchulzeVote(voter, weight, ranking))
+                else:
+                    poll.addVote(MedianVote(voter, weight, value))
+            polls.append(poll)
+        return voters, polls
+
+    def loadResults(self, sessionId):
+        """Gibt die gespeicherten Ergebnisse einer Sitzung als Dictionary
+        Name der Abstimmung -> (requiredVotes, weightSum, acceptedValue,
+        ranks, d) zurück.
+        """
+        rows = self.conn.execute(
+            'SELECT p.name, r.required_votes, r.weight_sum, '
+            'r.accepted_value, r.ranks, r.d FROM results r '
+            'JOIN polls p ON p.id = r.poll_id WHERE p.session_id = ?',
+            (sessionId,))
+        result = {}
+        for name, required, weightSum, accepted, ranks, d in rows:
+            if ranks is not None:
+                ranks = json.loads(ranks)
+                d = json.loads(d)
+            result[name] = (required, weightSum, accepted, ranks, d)
+        return result
+
+    def medianPollsAbstained(self, voter, minValue=None):
+        """Alle Finanzanträge bei denen voter sich enthalten hat.
+
+        Args:
+            voter (string): Name des Abstimmenden
+            minValue (int): Nur Anträge über diesem Betrag (in Cent)
+
+        Returns:
+            Eine Liste von (Sitzungstitel, Name des Antrags, Betrag)
+        """
+        query = ('SELECT s.title, p.name, p.max_value FROM ballots b '
+                 'JOIN polls p ON p.id = b.poll_id '
+                 'JOIN sessions s ON s.id = p.session_id '
+                 "WHERE b.voter = ? AND b.value IS NULL AND p.type = 'median'")
+        args = [voter]
+        if minValue is not None:
+            query += ' AND p.max_value > ?'
+            args.append(minValue)
+        query += ' ORDER BY s.id, p.position'
+        return self.conn.execute(query, args).fetchall()
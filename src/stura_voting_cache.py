@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_cache.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Cache für eingelesene Stimmberechtigte und Abstimmungen.
+
+Das Ergebnis von parseVoters und parsePolls wird im Cache-Verzeichnis
+des Benutzers gespeichert. Der Schlüssel besteht aus Pfad, Größe,
+Änderungszeit und SHA-256 des Inhalts, ein Eintrag wird also nur für
+exakt die gleiche Datei verwendet. Gespeichert wird mit marshal (nur
+Tupel, Listen und Strings), das ist schnell und führt anders als pickle
+keinen Code aus.
+
+Ist der Cache größer als maxSize werden die am längsten nicht
+verwendeten Einträge gelöscht (die Änderungszeit eines Eintrags wird
+bei jedem Treffer aktualisiert).
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+
+from stura_voting_io import *
+
+
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+CACHE_VERSION = 1
+
+
+def defaultCacheDir():
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'stura-voting')
+
+
+def encodeSkel(skel):
+    if isinstance(skel, (MedianSkel, MedianPoll)):
+        return ('median', skel.name, skel.percentRequired, skel.allVotes,
+                skel.maxValue)
+    return ('schulze', skel.name, skel.percentRequired, skel.allVotes,
+            list(skel.options))
+
+
+def decodeSkel(t):
+    kind, name, percentRequired, allVotes, extra = t
+    if kind == 'median':
+        return MedianSkel(name, percentRequired, allVotes, extra)
+    return SchulzeSkel(name, percentRequired, allVotes, extra)
+
+
+class ParseCache(object):
+
+    """Liest Dateien mit parseVoters / parsePolls ein und speichert das
+    Ergebnis, bei unveränderten Dateien wird nicht erneut geparst.
+    """
+
+    def __init__(self, directory=None, maxSize=DEFAULT_CACHE_SIZE):
+        """
+        Args:
+            directory (string): Verzeichnis des Caches, None für das
+                Cache-Verzeichnis des Benutzers
+            maxSize (int): Maximale Gesamtgröße der Einträge in Bytes
+        """
+        self.directory = defaultCacheDir() if directory is None \
+            else directory
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+
+    def entryPath(self, kind, path, extra=''):
+        """Gibt den Pfad des Eintrags für die Datei path zurück."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+        key = '\0'.join((str(CACHE_VERSION), kind, extra, path,
+                         str(st.st_size), str(st.st_mtime_ns),
+                         h.hexdigest()))
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.bin')
+
+    def load(self, entry):
+        try:
+            with open(entry, 'rb') as f:
+                data = marshal.load(f)
+            # Zeitpunkt der letzten Verwendung für die LRU Reihenfolge
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        except (EnvironmentError, EOFError, ValueError, TypeError):
+            self.remove(entry)
+            return None
+        return data
+
+    def remove(self, entry):
+        try:
+            os.remove(entry)
+        except EnvironmentError:
+            pass
+
+    def store(self, entry, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmpPath = '%s.%d.tmp' % (entry, os.getpid())
+            with open(tmpPath, 'wb') as f:
+                marshal.dump(data, f)
+            os.replace(tmpPath, entry)
+            self.evict()
+        except EnvironmentError:
+            # ohne Cache weiterarbeiten
+            pass
+
+    def evict(self):
+        """Löscht die ältesten Einträge bis maxSize eingehalten wird."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.bin'):
+                continue
+            p = os.path.join(self.directory, name)
+            try:
+                st = os.stat(p)
+            except EnvironmentError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, p))
+            total += st.st_size
+        entries.sort()
+        for _, size, p in entries:
+            if total <= self.maxSize:
+                break
+            self.remove(p)
+            total -= size
+
+    def cached(self, kind, path, extra, parse, encode, decode):
+        try:
+            entry = self.entryPath(kind, path, extra)
+        except EnvironmentError:
+            # Fehlermeldung wie gewohnt von parse
+            return parse()
+        data = self.load(entry)
+        if data is not None:
+            try:
+                result = decode(data)
+            except (ValueError, TypeError):
+                self.remove(entry)
+            else:
+                self.hits += 1
+                return result
+        self.misses += 1
+        result = parse()
+        self.store(entry, encode(result))
+        return result
+
+    def parseVoters(self, path, delimiter=';'):
+        return self.cached(
+            'voters', path, delimiter,
+            lambda: parseVoters(path, delimiter),
+            lambda voters: [(v.name, v.weight) for v in voters],
+            lambda data: [WeightedVote(name, weight)
+                          for name, weight in data])
+
+    def parsePolls(self, path):
+        return self.cached(
+            'polls', path, '',
+            lambda: parsePolls(path),
+            lambda skels: [encodeSkel(s) for s in skels],
+            lambda data: [decodeSkel(t) for t in data])
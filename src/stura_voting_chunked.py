@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_chunked.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Auswertung von Schulze-Abstimmungen mit sehr vielen Stimmen.
+
+Die Stimmen werden blockweise gelesen und d wird Block für Block
+aufsummiert, der Speicherbedarf hängt also nur von der Blockgröße und
+der Anzahl der Optionen ab, nicht von der Anzahl der Abstimmenden.
+
+Binärformat: Header '<4sI' (Magic b'SVSB', Anzahl der Optionen n),
+danach ein Eintrag '<(n+2)i' pro Stimme: abgestimmt (0 oder 1),
+Gewicht und n Rangstufen.
+"""
+
+import csv
+import mmap
+import os
+import struct
+
+from stura_voting import *
+
+
+BINARY_MAGIC = b'SVSB'
+BINARY_HEADER = struct.Struct('<4sI')
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class BallotFileException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def binaryRecord(numOptions):
+    return struct.Struct('<%di' % (numOptions + 2))
+
+
+def writeSchulzeBinary(path, votes, numOptions):
+    """Schreibt Stimmen (z.B. aus einem Generator) in das Binärformat.
+
+    Args:
+        votes (iterable<SchulzeVote>): Die Stimmen, ranking kann None sein.
+        numOptions (int): Anzahl der Optionen
+    """
+    record = binaryRecord(numOptions)
+    empty = [0] * numOptions
+    with open(path, 'wb') as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, numOptions))
+        for vote in votes:
+            if vote.ranking is None:
+                f.write(record.pack(0, vote.weight, *empty))
+            else:
+                if len(vote.ranking) != numOptions:
+                    raise BallotFileException(
+                        'Falsche Anzahl an Abstimmungsgegenständen bei %s' %
+                        vote.name)
+                f.write(record.pack(1, vote.weight, *vote.ranking))
+
+
+def binaryInfo(path):
+    """Gibt (Anzahl Optionen, Anzahl Stimmen) einer Binärdatei zurück."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(BINARY_HEADER.size)
+    if len(header) != BINARY_HEADER.size:
+        raise BallotFileException('%s ist keine gültige Stimmdatei' % path)
+    magic, numOptions = BINARY_HEADER.unpack(header)
+    if magic != BINARY_MAGIC:
+        raise BallotFileException('%s ist keine gültige Stimmdatei' % path)
+    record = binaryRecord(numOptions)
+    body = size - BINARY_HEADER.size
+    if body % record.size != 0:
+        raise BallotFileException('%s ist unvollständig' % path)
+    return numOptions, body // record.size
+
+
+def binaryChunks(path, chunkSize=DEFAULT_CHUNK_SIZE):
+    """Liest die Stimmen einer Binärdatei blockweise über mmap.
+
+    Gibt Listen von höchstens chunkSize SchulzeVote Objekten zurück.
+    """
+    numOptions, total = binaryInfo(path)
+    if total == 0:
+        return
+    record = binaryRecord(numOptions)
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start in range(0, total, chunkSize):
+                stop = min(start + chunkSize, total)
+                offset = BINARY_HEADER.size + start * record.size
+                data = mm[offset:offset + (stop - start) * record.size]
+                chunk = []
+                for values in record.iter_unpack(data):
+                    ranking = list(values[2:]) if values[0] else None
+                    chunk.append(SchulzeVote('', values[1], ranking))
+                yield chunk
+        finally:
+            mm.close()
+
+
+def csvChunks(path, poll, voters, chunkSize=DEFAULT_CHUNK_SIZE,
+              delimiter=';'):
+    """Liest die Spalte von poll aus einer Tabelle wie sie readTable
+    erwartet blockweise.
+
+    Args:
+        poll (SchulzePoll): Die Abstimmung, die Spalte wird über den Namen
+            gesucht.
+        voters (list<WeightedVote>): Die Abstimmenden für die Gewichte.
+    """
+    votersMap = {v.name: v for v in voters}
+    with open(path, 'r') as csvfile:
+        reader = csv.reader(csvfile, delimiter=delimiter)
+        head = next(reader)[1:]
+        try:
+            column = head.index(poll.name) + 1
+        except ValueError:
+            raise BallotFileException(
+                'Abstimmung "%s" nicht in %s gefunden' % (poll.name, path))
+        chunk = []
+        for line in reader:
+            if not line:
+                continue
+            vName = line[0]
+            if vName not in votersMap:
+                raise BallotFileException('Unbekannter Abstimmender "%s"' %
+                                          vName)
+            voter = votersMap[vName]
+            val = line[column] if column < len(line) else ''
+            chunk.append(poll.makeVote(voter, val))
+            if len(chunk) >= chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def evaluateSchulzeChunks(poll, chunks, progress=None, total=None):
+    """Wertet eine Schulze-Abstimmung blockweise aus.
+
+    Für jeden Block wird d mit dem Verfahren von poll.engine berechnet
+    und aufsummiert. Die einzelnen Stimmen werden nicht behalten,
+    actualVotes im Ergebnis ist daher None.
+
+    Args:
+        poll (SchulzePoll): Die Abstimmung, poll.votes wird nicht verwendet.
+        chunks (iterable<list<SchulzeVote>>): Die Stimmen in Blöcken
+        progress (function): Wird nach jedem Block mit der Anzahl der
+            bisher gelesenen Stimmen und total aufgerufen.
+        total (int): Anzahl aller Stimmen falls bekannt, sonst None.
+    """
+    numChoices = len(poll.options)
+    d = [[0 for j in range(numChoices)] for i in range(numChoices)]
+    weightSum = 0
+    done = 0
+    for chunk in chunks:
+        actualVotes = []
+        for vote in chunk:
+            vote = poll.actualVote(vote)
+            if vote is not None:
+                if len(vote.ranking) != numChoices:
+                    raise BallotFileException(
+                        'Falsche Anzahl an Abstimmungsgegenständen bei %s' %
+                        vote.name)
+                actualVotes.append(vote)
+                weightSum += vote.weight
+        chunkD = poll.computeDWithEngine(actualVotes)
+        for i in range(numChoices):
+            row, chunkRow = d[i], chunkD[i]
+            for j in range(numChoices):
+                row[j] += chunkRow[j]
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    return poll.resultFromD(None, weightSum, d)
+
+
+def evaluateSchulzeBinary(poll, path, chunkSize=DEFAULT_CHUNK_SIZE,
+                          progress=None):
+    numOptions, total = binaryInfo(path)
+    if numOptions != len(poll.options):
+        raise BallotFileException(
+            '%s enthält %d Optionen, die Abstimmung hat %d' %
+            (path, numOptions, len(poll.options)))
+    return evaluateSchulzeChunks(poll, binaryChunks(path, chunkSize),
+                                 progress, total)
+
+
+def evaluateSchulzeCSV(poll, path, voters, chunkSize=DEFAULT_CHUNK_SIZE,
+                       progress=None, delimiter=';'):
+    chunks = csvChunks(path, poll, voters, chunkSize, delimiter)
+    return evaluateSchulzeChunks(poll, chunks, progress)
@@ -30,7 +30,7 @@ from tkinter import messagebox
 import tkinter.scrolledtext
 import datetime
 
-from stura_voting_io import *
+from stura_voting_cache import *
 
 
 stura_voting_copyright = """Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
@@ -51,6 +51,9 @@ along with stura-voting.
 If not, see <http://www.gnu.org/licenses/>.
 """
 
+# Wähler- und Abstimmungsdateien nur einmal parsen
+parseCache = ParseCache()
+
 
 class SturaMainFrame(tkinter.Frame):
 
@@ -153,7 +156,7 @@ class SturaMainFrame(tkinter.Frame):
             return
         voters = None
         try:
-            voters = parseVoters(name)
+            voters = parseCache.parseVoters(name)
         except VoterParseException as e:
             messagebox.showerror('Datei öffnen fehlgeschlagen', str(e))
             return
@@ -175,7 +178,7 @@ class SturaMainFrame(tkinter.Frame):
             return
         polls = None
         try:
-            polls = parsePolls(name)
+            polls = parseCache.parsePolls(name)
         except PollParseException as e:
             messagebox.showerror('Datei öffnen fehlgeschlagen', str(e))
             return
@@ -271,7 +274,7 @@ class SturaMainFrame(tkinter.Frame):
                 self,
                 p.name,
                 p.percentRequired,
-                p.maxValue,
+                formatCents(p.maxValue),
                 p.allVotes)
             if not d.succ:
                 return
@@ -362,9 +365,10 @@ class MedianDialog(simpledialog.Dialog):
 
     def checkTypes(self):
         try:
-            self.val = float(self.val)
+            self.val = parseCents(self.val)
         except ValueError:
-            raise ValueError('%s ist keine Zahl' % self.val)
+            # auch Dezimalpunkt erlauben, z.B. "1000.50"
+            self.val = decimalToCents(self.val)
         try:
             self.req = float(self.req)
         except ValueError:
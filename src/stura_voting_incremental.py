@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_incremental.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Erneutes Einlesen einer geänderten Stimmtabelle.
+
+Für jede Zeile der Tabelle (wie von createInputCSV erzeugt) wird ein
+Hash gespeichert. Beim erneuten Einlesen werden nur die Zellen
+geänderter Zeilen verglichen, nur die betroffenen Abstimmungen werden
+neu ausgewertet, für alle anderen wird das letzte Ergebnis verwendet.
+"""
+
+import csv
+import hashlib
+
+from stura_voting_io import *
+
+
+def rowHash(line):
+    return hashlib.sha1('\x1f'.join(line).encode('utf-8')).digest()
+
+
+def pollFingerprint(poll):
+    """Hash über alles was in die Auswertung einer Abstimmung eingeht:
+    Typ, Einstellungen und alle Stimmen mit Gewicht.
+    """
+    h = hashlib.sha1()
+    extra = getattr(poll, 'options', getattr(poll, 'maxValue', None))
+    h.update(repr((type(poll).__name__, poll.name, poll.percentRequired,
+                   poll.allVotes, extra)).encode('utf-8'))
+    for vote in poll.votes:
+        value = getattr(vote, 'ranking', getattr(vote, 'value', None))
+        h.update(repr((vote.name, vote.weight, value)).encode('utf-8'))
+    return h.digest()
+
+
+class IncrementalTable(object):
+
+    """Stimmtabelle einer Sitzung, die wiederholt eingelesen werden kann.
+
+    Beispiel:
+        table = IncrementalTable(voters, skels)
+        table.load(path)
+        ...
+        changed = table.load(path)  # nach einer Korrektur
+        html = table.html(title)
+    """
+
+    def __init__(self, voters, skels, delimiter=';', cache=None):
+        """
+        Args:
+            voters (list<WeightedVote>): Die Abstimmenden
+            skels (list<PollSkel>): Die Abstimmungen in der Reihenfolge
+                der Spalten
+            cache (dict): Ergebnisse nach pollFingerprint, z.B. von einer
+                vorherigen Tabelle mit anderen Abstimmenden. Abstimmungen
+                deren Eingaben gleich geblieben sind werden daraus
+                übernommen statt neu ausgewertet.
+        """
+        self.votersMap = {v.name: v for v in voters}
+        self.skels = skels
+        self.delimiter = delimiter
+        self.cache = {} if cache is None else cache
+        self.reset()
+
+    def reset(self):
+        self.polls = [s.emptyPoll() for s in self.skels]
+        self.head = None
+        self.rows = {}
+        self.order = []
+        # pro Abstimmung: Name des Abstimmenden -> Vote
+        self.votes = [{} for s in self.skels]
+        self.results = [None] * len(self.skels)
+        self.fingerprints = [None] * len(self.skels)
+
+    def readLines(self, path):
+        with open(path, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter=self.delimiter)
+            head = next(reader, [])[1:]
+            lines = [line for line in reader if line]
+        return head, lines
+
+    def load(self, path):
+        """Liest die Tabelle (erneut) ein.
+
+        Bei einer MakeVoteException bleibt der vorherige Stand erhalten.
+
+        Returns:
+            Die Indizes der Abstimmungen die sich geändert haben.
+        """
+        head, lines = self.readLines(path)
+        # bei anderen Spalten alles neu einlesen, der alte Stand wird aber
+        # erst verworfen wenn alle Zeilen gültig sind
+        headChanged = head != self.head
+        oldRows = {} if headChanged else self.rows
+        numPolls = len(self.polls)
+        rows = {}
+        order = []
+        updates = []
+        for line in lines:
+            vName = line[0]
+            if vName in rows:
+                raise MakeVoteException('Doppelter Eintrag für %s' % vName)
+            if vName not in self.votersMap:
+                raise MakeVoteException('Unbekannter Abstimmender %s' % vName)
+            cells = line[1:numPolls + 1]
+            cells.extend([''] * (numPolls - len(cells)))
+            h = rowHash(cells)
+            order.append(vName)
+            rows[vName] = (h, cells)
+            old = oldRows.get(vName)
+            if old is not None and old[0] == h:
+                continue
+            voter = self.votersMap[vName]
+            for i, (p, val) in enumerate(zip(self.polls, cells)):
+                if old is None or old[1][i] != val:
+                    updates.append((i, vName, p.makeVote(voter, val)))
+        if headChanged:
+            self.reset()
+        changed = set(i for i, _, _ in updates)
+        for vName in self.rows:
+            if vName not in rows:
+                # Zeile wurde entfernt
+                for i, votes in enumerate(self.votes):
+                    if vName in votes:
+                        del votes[vName]
+                        changed.add(i)
+        for i, vName, vote in updates:
+            self.votes[i][vName] = vote
+        self.head = head
+        self.rows = rows
+        self.order = order
+        for i in changed:
+            poll = self.polls[i]
+            votes = self.votes[i]
+            poll.votes = [votes[vName] for vName in order if vName in votes]
+            self.results[i] = None
+        return sorted(changed)
+
+    def evaluate(self):
+        """Gibt Paare (Abstimmung, Ergebnis) zurück, ausgewertet werden nur
+        die Abstimmungen die sich seit der letzten Auswertung geändert
+        haben.
+        """
+        cache = {}
+        for i, poll in enumerate(self.polls):
+            if self.results[i] is None:
+                fingerprint = pollFingerprint(poll)
+                if fingerprint in self.cache:
+                    instrumentation.count('incremental.reuse')
+                    self.results[i] = self.cache[fingerprint]
+                else:
+                    instrumentation.count('incremental.evaluate')
+                    self.results[i] = poll.evaluate()
+                self.fingerprints[i] = fingerprint
+            cache[self.fingerprints[i]] = self.results[i]
+        # nur die Ergebnisse der aktuellen Abstimmungen behalten
+        self.cache = cache
+        return list(zip(self.polls, self.results))
+
+    def html(self, title):
+        return pollsToHtml(title, self.evaluate())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_ingest.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Annahme von Stimmen über TCP (asyncio).
+
+Zählstellen senden Zeilen der Form
+
+    voter;poll;value
+
+wobei value wie in der Tabelle aus readTable angegeben wird (leer für
+Enthaltung). Jede Zeile wird mit makeVote der Abstimmung geprüft und in
+der gesendeten Reihenfolge mit "OK <nr>" oder "ERR <nr> <Meldung>"
+bestätigt, nr ist die Zeilennummer innerhalb der Verbindung. OK wird
+erst gesendet, wenn die Stimme in der Abstimmung gespeichert ist und,
+falls die Abstimmung ein BallotLog hat, das Log mit commit auf die
+Platte geschrieben wurde. Kann die Stimme nicht gezählt werden, wird
+mit ERR geantwortet und sie darf erneut gesendet werden. Schlägt nur
+der commit des Logs fehl, ist die Stimme gezählt aber nicht dauerhaft
+gespeichert, dann wird "WARN <nr> <Meldung>" gesendet und die Stimme
+darf nicht erneut gesendet werden.
+
+Zeilen werden blockweise gelesen und als Batch in eine beschränkte
+Queue gelegt. Ist die Queue voll, liest die Verbindung nicht weiter
+(Backpressure über TCP). Alle wartenden Batches werden gemeinsam
+übernommen und mit einem commit pro Log bestätigt (Group Commit).
+"""
+
+import argparse
+import asyncio
+import copy
+import logging
+
+from stura_voting_io import *
+
+
+logger = logging.getLogger('stura_voting_ingest')
+
+
+class IngestService(object):
+
+    """Nimmt Stimmen von mehreren Verbindungen an und fügt sie den
+    Abstimmungen hinzu.
+    """
+
+    def __init__(self, voters, polls, queueSize=64, readSize=65536):
+        """
+        Args:
+            voters (list<WeightedVote>): Die Stimmberechtigten
+            polls (list<Poll>): Die Abstimmungen, ihnen werden die
+                angenommenen Stimmen mit addVote hinzugefügt
+            queueSize (int): Maximale Anzahl wartender Batches
+            readSize (int): So viele Bytes werden auf einmal gelesen
+        """
+        self.voters = {v.name: v for v in voters}
+        self.polls = {p.name: p for p in polls}
+        self.queueSize = queueSize
+        self.readSize = readSize
+        # (Abstimmung, Stimmberechtigter) die bereits angenommen wurden
+        self.claimed = set()
+        self.accepted = 0
+        self.queue = None
+
+    def parseLine(self, line):
+        """Prüft eine Zeile und gibt (Abstimmung, Vote) zurück.
+
+        Raises:
+            MakeVoteException: Falls die Zeile ungültig ist
+        """
+        parts = line.split(';', 1)
+        if len(parts) != 2 or ';' not in parts[1]:
+            raise MakeVoteException('Erwarte voter;poll;value')
+        voterName = parts[0].strip()
+        pollName, value = parts[1].rsplit(';', 1)
+        pollName = pollName.strip()
+        voter = self.voters.get(voterName)
+        if voter is None:
+            raise MakeVoteException('Unbekannter Stimmberechtigter %s' %
+                                    voterName)
+        poll = self.polls.get(pollName)
+        if poll is None:
+            raise MakeVoteException('Unbekannte Abstimmung %s' % pollName)
+        if (pollName, voterName) in self.claimed:
+            raise MakeVoteException('%s hat bei %s bereits abgestimmt' %
+                                    (voterName, pollName))
+        try:
+            vote = poll.makeVote(voter, value.strip())
+        except ValueError as e:
+            raise MakeVoteException('Ungültiger Wert von %s: %s' %
+                                    (voterName, e))
+        self.claimed.add((pollName, voterName))
+        return poll, vote
+
+    async def apply(self):
+        """Fügt die Batches aus der Queue den Abstimmungen hinzu.
+
+        Das Future jedes Batches erhält eine Liste mit einem Eintrag pro
+        Stimme: None falls sie gespeichert wurde, sonst die Antwort
+        (Art, Meldung), Art ist 'ERR' oder 'WARN'. Fehler werden pro Batch
+        behandelt, alle anderen Batches laufen weiter.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            results = []
+            logs = {}
+            for batch, done in items:
+                errors = [None] * len(batch)
+                count = 0
+                try:
+                    for poll, vote in batch:
+                        poll.addVote(vote)
+                        count += 1
+                        if poll.log is not None:
+                            logs[id(poll.log)] = poll.log
+                except Exception as e:
+                    logger.exception('Batch konnte nicht gespeichert werden')
+                    self.release(batch[count:])
+                    for k in range(count, len(batch)):
+                        errors[k] = ('ERR', 'Nicht gespeichert: %s' % e)
+                self.accepted += count
+                results.append((batch, done, errors))
+            failed = {}
+            for key, log in logs.items():
+                try:
+                    # fsync blockiert, daher nicht in der Event Loop
+                    await loop.run_in_executor(None, log.commit)
+                except Exception as e:
+                    logger.exception('Log konnte nicht geschrieben werden')
+                    failed[key] = e
+            for batch, done, errors in results:
+                for k, (poll, vote) in enumerate(batch):
+                    e = failed.get(id(poll.log))
+                    if errors[k] is None and e is not None:
+                        # die Stimme ist gezählt, ERR wäre falsch und eine
+                        # Wiederholung würde abgelehnt
+                        errors[k] = ('WARN', 'Gezählt, aber nicht dauerhaft '
+                                     'gespeichert: %s' % e)
+                if not done.done():
+                    done.set_result(errors)
+            for _ in items:
+                self.queue.task_done()
+
+    def release(self, batch):
+        """Gibt die Stimmberechtigten eines nicht gespeicherten Batches
+        wieder frei, sie dürfen erneut abstimmen.
+        """
+        for poll, vote in batch:
+            self.claimed.discard((poll.name, vote.name))
+
+    async def handle(self, reader, writer):
+        lineNo = 0
+        rest = b''
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                data = await reader.read(self.readSize)
+                if not data:
+                    if not rest:
+                        break
+                    data = b'\n'
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                batch = []
+                # Position in answers und Zeilennummer jeder Stimme im Batch
+                positions = []
+                answers = []
+                for raw in lines:
+                    line = raw.decode('utf-8', 'replace').strip()
+                    if not line:
+                        continue
+                    lineNo += 1
+                    try:
+                        batch.append(self.parseLine(line))
+                        positions.append((len(answers), lineNo))
+                        answers.append('OK %d' % lineNo)
+                    except MakeVoteException as e:
+                        answers.append('ERR %d %s' % (lineNo, e.msg))
+                if batch:
+                    done = asyncio.get_running_loop().create_future()
+                    # wartet falls die Queue voll ist
+                    await self.queue.put((batch, done))
+                    errors = await done
+                    for (i, no), error in zip(positions, errors):
+                        if error is not None:
+                            answers[i] = '%s %d %s' % (error[0], no, error[1])
+                if answers:
+                    writer.write(('\n'.join(answers) + '\n').encode('utf-8'))
+                    await writer.drain()
+        except ConnectionError as e:
+            logger.warning('Verbindung %s abgebrochen: %s', peer, e)
+        finally:
+            writer.close()
+
+    def snapshot(self):
+        """Gibt Kopien der Abstimmungen mit den bisher angenommenen
+        Stimmen zurück, diese können ausgewertet werden während weiter
+        Stimmen angenommen werden.
+        """
+        polls = []
+        for poll in self.polls.values():
+            c = copy.copy(poll)
+            c.votes = list(poll.votes)
+            c.log = None
+            polls.append(c)
+        return polls
+
+    async def evaluate(self):
+        """Wertet eine Kopie der Abstimmungen in einem Thread aus und gibt
+        Paare (Abstimmung, Ergebnis) zurück.
+        """
+        polls = self.snapshot()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: [(p, p.evaluate()) for p in polls])
+
+    async def start(self, host='127.0.0.1', port=9090):
+        """Startet den Server und gibt das asyncio Server Objekt zurück."""
+        self.queue = asyncio.Queue(self.queueSize)
+        self.applier = asyncio.ensure_future(self.apply())
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def main(args):
+    voters = parseVoters(args.voters)
+    polls = [s.emptyPoll() for s in parsePolls(args.polls)]
+    service = IngestService(voters, polls)
+    server = await service.start(args.host, args.port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Stimmen von Zählstellen über TCP annehmen')
+    parser.add_argument('voters')
+    parser.add_argument('polls')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -25,6 +25,7 @@
 from xml.etree.ElementTree import Element, SubElement
 import xml.dom.minidom as minidom
 import csv
+import json
 
 from dominate import document
 from dominate.tags import *
@@ -102,7 +103,10 @@ def getGeneralInformation(node):
 def parseMedianSkel(node):
     attributes = node.attributes
     name, percent, allVotes = getGeneralInformation(node)
-    maxValue = float(attributes['maxValue'].value)
+    try:
+        maxValue = decimalToCents(attributes['maxValue'].value)
+    except ValueError as e:
+        raise PollParseException(str(e))
     return MedianSkel(name, percent, allVotes, maxValue)
 
 
@@ -167,3 +171,72 @@ def pollsToHtml(title, results):
         with doc:
             r.htmlOutput(doc, p)
     return doc
+
+
+def writeMatrix(f, key, matrix):
+    """Schreibt eine Matrix zeilenweise als flaches Array, ohne einen
+    String für die ganze Matrix zu erzeugen.
+    """
+    f.write(', "%s": [' % key)
+    first = True
+    for row in matrix:
+        if not first:
+            f.write(',')
+        f.write(','.join(str(x) for x in row))
+        first = False
+    f.write(']')
+
+
+def writeResultJSON(f, poll, result, includeP=False):
+    """Schreibt das Ergebnis einer Abstimmung als eine JSON Zeile.
+
+    Beträge sind in Cent. Die Matrizen d und p werden als flaches Array
+    der Länge n*n (zeilenweise) geschrieben.
+    """
+    if isinstance(result, SchulzeResult):
+        head = {'type': 'schulze', 'name': poll.name,
+                'options': poll.options, 'n': len(poll.options),
+                'requiredVotes': result.requiredVotes,
+                'weightSum': result.weightSum, 'partial': result.partial,
+                'ranks': result.ranks}
+        f.write(json.dumps(head)[:-1])
+        writeMatrix(f, 'd', result.d)
+        if includeP and result.p is not None:
+            writeMatrix(f, 'p', result.p)
+        f.write('}\n')
+    else:
+        head = {'type': 'median', 'name': poll.name,
+                'maxValue': poll.maxValue,
+                'requiredVotes': result.requiredVotes,
+                'weightSum': result.weightSum,
+                'acceptedValue': result.acceptedValue}
+        f.write(json.dumps(head) + '\n')
+
+
+def writeResultsJSONLines(f, pairs, includeP=False):
+    """Schreibt eine JSON Zeile pro Abstimmung, sobald ihr Ergebnis
+    vorliegt.
+
+    Args:
+        f (file): Zum Schreiben geöffnete Datei
+        pairs (iterable): Paare (Abstimmung, Ergebnis), z.B. von
+            evaluatePolls, damit jede Abstimmung erst direkt vor dem
+            Schreiben ausgewertet wird.
+        includeP (bool): Ob bei Schulze auch p geschrieben wird
+    """
+    for poll, result in pairs:
+        writeResultJSON(f, poll, result, includeP)
+        f.flush()
+
+
+def evaluatePolls(polls):
+    """Wertet die Abstimmungen nacheinander aus und gibt Paare
+    (Abstimmung, Ergebnis) zurück.
+    """
+    for poll in polls:
+        yield poll, poll.evaluate()
+
+
+def exportJSONLines(path, polls, includeP=False):
+    with open(path, 'w') as f:
+        writeResultsJSONLines(f, evaluatePolls(polls), includeP)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_npz.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Import und Export der Stimmen einer Sitzung als NumPy .npz Archiv.
+
+NumPy wird nur für dieses Modul benötigt und ist optional.
+
+Inhalt des Archivs (unkomprimiert, damit mmap möglich ist):
+    skels: JSON mit den Abstimmungen (wie in stura_voting_cache)
+    voters: Namen der Stimmberechtigten (Unicode)
+    weights: Gewichte (int64)
+    poll_<i>: Für Median ein float64 Vektor mit dem Betrag in Euro, NaN
+        für Enthaltung. Für Schulze eine int32 Matrix (Stimmen x Optionen)
+        mit den Rangstufen, eine Zeile aus -1 für Enthaltung.
+
+Beim Import werden Beträge auf ganze Cent gerundet.
+"""
+
+import json
+import struct
+import zipfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from stura_voting_cache import *
+
+
+class NPZException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def requireNumpy():
+    if numpy is None:
+        raise NPZException('Für .npz Dateien wird NumPy benötigt')
+
+
+def exportNPZ(path, voters, polls):
+    """Speichert die Stimmen der Abstimmungen als .npz Archiv.
+
+    Args:
+        voters (list<WeightedVote>): Die Stimmberechtigten, gibt die
+            Reihenfolge der Zeilen vor
+        polls (list<Poll>): Die Abstimmungen (z.B. aus readTable), fehlt
+            die Stimme eines Stimmberechtigten zählt sie als Enthaltung
+    """
+    requireNumpy()
+    arrays = {
+        'skels': numpy.array(json.dumps([encodeSkel(p) for p in polls])),
+        'voters': numpy.array([v.name for v in voters], dtype=str),
+        'weights': numpy.array([v.weight for v in voters], dtype=numpy.int64),
+    }
+    for i, poll in enumerate(polls):
+        byName = {vote.name: vote for vote in poll.votes}
+        votes = [byName.get(v.name) for v in voters]
+        if isinstance(poll, MedianPoll):
+            column = numpy.full(len(voters), numpy.nan)
+            for row, vote in enumerate(votes):
+                if vote is not None and vote.value is not None:
+                    column[row] = vote.value / 100
+        else:
+            column = numpy.full((len(voters), len(poll.options)), -1,
+                                dtype=numpy.int32)
+            for row, vote in enumerate(votes):
+                if vote is not None and vote.ranking is not None:
+                    column[row] = vote.ranking
+        arrays['poll_%d' % i] = column
+    numpy.savez(path, **arrays)
+
+
+def memmapMember(path, archive, name):
+    """Bildet ein unkomprimiertes Array des Archivs per mmap ab."""
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise NPZException('%s ist komprimiert, mmap nicht möglich' % name)
+    with open(path, 'rb') as f:
+        # lokaler Header der ZIP Datei: 30 Bytes, dann Name und Extra
+        f.seek(info.header_offset + 26)
+        nameLength, extraLength = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + nameLength + extraLength)
+        version = numpy.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = numpy.lib.format.read_array_header_1_0(f)
+        else:
+            header = numpy.lib.format.read_array_header_2_0(f)
+        shape, fortran, dtype = header
+        offset = f.tell()
+    if dtype.hasobject:
+        raise NPZException('%s enthält Python Objekte' % name)
+    if 0 in shape:
+        return numpy.zeros(shape, dtype)
+    return numpy.memmap(path, dtype, 'r', offset, shape,
+                        'F' if fortran else 'C')
+
+
+class ArrayBallots(object):
+
+    """Die Stimmen einer Sitzung als Arrays, ohne Objekte pro Stimme."""
+
+    def __init__(self, skels, voters, weights, columns):
+        """
+        Args:
+            skels (list<PollSkel>): Die Abstimmungen
+            voters (array): Namen der Stimmberechtigten
+            weights (array): Gewichte, int64
+            columns (list<array>): Die Stimmen jeder Abstimmung, siehe
+                Beschreibung des Formats
+        """
+        self.skels = skels
+        self.voters = voters
+        self.weights = weights
+        self.columns = columns
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """Lädt ein mit exportNPZ geschriebenes Archiv.
+
+        Args:
+            mmap (bool): Die Arrays nicht einlesen sondern per mmap
+                abbilden, so werden nur die benötigten Seiten gelesen
+        """
+        requireNumpy()
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                skels = [decodeSkel(t) for t in json.loads(str(data['skels']))]
+                if not mmap:
+                    columns = [data['poll_%d' % i] for i in range(len(skels))]
+                    return cls(skels, data['voters'], data['weights'],
+                               columns)
+            with zipfile.ZipFile(path) as archive:
+                arrays = [memmapMember(path, archive, name + '.npy')
+                          for name in ['voters', 'weights'] +
+                          ['poll_%d' % i for i in range(len(skels))]]
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise NPZException('%s ist kein gültiges Archiv: %s' % (path, e))
+        return cls(skels, arrays[0], arrays[1], arrays[2:])
+
+    def evaluateMedian(self, poll, column):
+        weights = self.weights
+        values = numpy.round(column * 100)
+        voted = ~numpy.isnan(values)
+        if poll.allVotes:
+            values = numpy.where(voted, values, 0)
+        else:
+            values = values[voted]
+            weights = weights[voted]
+        curve = MedianCurve([])
+        if len(values):
+            # Gewichte gleicher Beträge zusammenfassen, absteigend
+            unique, inverse = numpy.unique(values, return_inverse=True)
+            sums = numpy.bincount(inverse, weights=weights,
+                                  minlength=len(unique))
+            curve.values = [int(v) for v in unique[::-1]]
+            curve.cumWeights = [int(w) for w in numpy.cumsum(sums[::-1])]
+            curve.weightSum = curve.cumWeights[-1]
+        return MedianResult(None, curve.requiredVotes(poll.percentRequired),
+                            curve.weightSum,
+                            curve.acceptedValue(poll.percentRequired), curve)
+
+    def evaluateSchulze(self, poll, column):
+        n = len(poll.options)
+        weights = self.weights
+        voted = column[:, 0] >= 0
+        if poll.allVotes:
+            # Enthaltung als Nein Stimme, siehe SchulzePoll.actualVote
+            no = numpy.ones(n, dtype=column.dtype)
+            no[-1] = 0
+            column = numpy.where(voted[:, None], column, no)
+        else:
+            column = column[voted]
+            weights = weights[voted]
+        d = [[int(x) for x in weights @ (column[:, i:i + 1] < column)]
+             for i in range(n)]
+        return poll.resultFromD(None, int(weights.sum()), d)
+
+    def evaluate(self):
+        """Wertet alle Abstimmungen aus.
+
+        Returns:
+            list: Paare (Abstimmung, Ergebnis), die Abstimmungen enthalten
+                keine Stimmen, actualVotes der Ergebnisse ist None
+        """
+        result = []
+        for skel, column in zip(self.skels, self.columns):
+            poll = skel.emptyPoll()
+            if isinstance(poll, MedianPoll):
+                r = self.evaluateMedian(poll, numpy.asarray(column))
+            else:
+                r = self.evaluateSchulze(poll, numpy.asarray(column))
+            result.append((poll, r))
+        return result
+
+    def toPolls(self):
+        """Erzeugt Abstimmungen mit Vote Objekten wie readTable."""
+        voters = [WeightedVote(str(name), int(weight))
+                  for name, weight in zip(self.voters, self.weights)]
+        polls = []
+        for skel, column in zip(self.skels, self.columns):
+            poll = skel.emptyPoll()
+            if isinstance(poll, MedianPoll):
+                for v, value in zip(voters, column.tolist()):
+                    value = None if value != value else int(round(value * 100))
+                    poll.votes.append(MedianVote(v.name, v.weight, value))
+            else:
+                for v, ranking in zip(voters, column.tolist()):
+                    if ranking and ranking[0] < 0:
+                        ranking = None
+                    poll.votes.append(SchulzeVote(v.name, v.weight, ranking))
+            polls.append(poll)
+        return polls
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_parallel.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Parallele Auswertung von Abstimmungen.
+
+Enthält die parallele Berechnung der Matrix p für Schulze-Abstimmungen
+mit sehr vielen Optionen und die Auswertung mehrerer Abstimmungen in
+mehreren Prozessen, wobei die Stimmen nur einmal in gemeinsame
+Speicherbereiche geschrieben werden.
+
+Für p wird ein geblockter Floyd-Warshall (stärkste Pfade): Die
+Matrix wird in Kacheln aufgeteilt, für jede Kachel k auf der Diagonalen
+wird zuerst diese Kachel, dann ihre Zeile und Spalte und zuletzt der
+Rest aktualisiert. Die Kacheln der letzten beiden Phasen sind
+unabhängig voneinander und werden von mehreren Prozessen bearbeitet,
+die Matrix liegt dabei in einem gemeinsamen Speicherbereich.
+"""
+
+import array
+import atexit
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+from stura_voting import *
+import stura_voting_chunked
+
+DEFAULT_BLOCK_SIZE = 64
+
+# Median-Betrag (in Cent) für Enthaltungen im gemeinsamen Speicher
+ABSTENTION = -2 ** 63
+
+# Zustand eines Worker-Prozesses, gesetzt von attachWorker
+_worker = {}
+
+
+def initialP(d):
+    """Erstellt p vor dem Floyd-Warshall Schritt als flaches Array.
+    """
+    n = len(d)
+    p = array.array('q', bytes(8 * n * n))
+    for i in range(n):
+        for j in range(n):
+            if i != j and d[i][j] > d[j][i]:
+                p[i * n + j] = d[i][j]
+    return p
+
+
+def blockRange(block, blockSize, n):
+    return range(block * blockSize, min((block + 1) * blockSize, n))
+
+
+def updateBlock(p, n, blockSize, bi, bj, bk):
+    """Aktualisiert die Kachel (bi, bj) über die Zwischenknoten der
+    Kachel bk. p ist die flache Matrix (array oder memoryview).
+
+    Kacheln die mit (bi, bj) übereinstimmen werden nicht kopiert, damit
+    innerhalb der Kachel die Werte wie beim normalen Floyd-Warshall
+    sofort verwendet werden.
+    """
+    rows = blockRange(bi, blockSize, n)
+    cols = blockRange(bj, blockSize, n)
+    ks = blockRange(bk, blockSize, n)
+    c = [p[i * n + cols.start:i * n + cols.stop].tolist() for i in rows]
+    if bj == bk:
+        a = c
+    else:
+        a = [p[i * n + ks.start:i * n + ks.stop].tolist() for i in rows]
+    if bi == bk:
+        b = c
+    else:
+        b = [p[k * n + cols.start:k * n + cols.stop].tolist() for k in ks]
+    for k in range(len(ks)):
+        bk_ = b[k]
+        for i in range(len(rows)):
+            aik = a[i][k]
+            if not aik:
+                continue
+            ci = c[i]
+            for j in range(len(cols)):
+                v = bk_[j]
+                if v > aik:
+                    v = aik
+                if v > ci[j]:
+                    ci[j] = v
+    for i, row in zip(rows, c):
+        p[i * n + cols.start:i * n + cols.stop] = array.array('q', row)
+
+
+def attachWorker(name):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['p'] = shm.buf.cast('q')
+
+
+def detachWorker():
+    if 'shm' in _worker:
+        _worker.pop('p').release()
+        _worker.pop('shm').close()
+
+
+def workerUpdate(task):
+    name, n, blockSize, blocks = task
+    # der Pool wird wiederverwendet, daher wird der Speicherbereich nur
+    # für diese Aufgaben eingebunden, sonst bliebe er nach
+    # parallelComputeP in untätigen Prozessen eingeblendet
+    attachWorker(name)
+    try:
+        for bi, bj, bk in blocks:
+            updateBlock(_worker['p'], n, blockSize, bi, bj, bk)
+    finally:
+        detachWorker()
+
+
+# Prozesse für parallelComputeP, werden zwischen Aufrufen wiederverwendet
+_pool = {}
+
+
+def getPool(workers):
+    """Gibt einen ProcessPoolExecutor mit workers Prozessen zurück, der
+    nur beim ersten Aufruf (oder nach einem Absturz) gestartet wird.
+    """
+    ex = _pool.get(workers)
+    if ex is None:
+        # die Prozesse sollen den resource_tracker dieses Prozesses
+        # verwenden und keinen eigenen starten
+        resource_tracker.ensure_running()
+        ex = _pool[workers] = ProcessPoolExecutor(workers)
+        # startet die Prozesse sofort, später mit fork gestartete würden
+        # die gerade angelegten Speicherbereiche erben
+        ex.submit(int).result()
+    return ex
+
+
+def shutdownPools():
+    for ex in _pool.values():
+        ex.shutdown()
+    _pool.clear()
+
+
+atexit.register(shutdownPools)
+
+
+def phases(numBlocks):
+    """Gibt für jede Diagonal-Kachel die drei Phasen als Listen von
+    Aufgaben (bi, bj, bk) zurück.
+    """
+    for bk in range(numBlocks):
+        yield [(bk, bk, bk)]
+        yield ([(bk, bj, bk) for bj in range(numBlocks) if bj != bk] +
+               [(bi, bk, bk) for bi in range(numBlocks) if bi != bk])
+        yield [(bi, bj, bk) for bi in range(numBlocks) if bi != bk
+               for bj in range(numBlocks) if bj != bk]
+
+
+def toMatrix(p, n):
+    result = [p[i * n:(i + 1) * n].tolist() for i in range(n)]
+    for i in range(n):
+        result[i][i] = 0
+    return result
+
+
+def parallelComputeP(d, workers=None, blockSize=DEFAULT_BLOCK_SIZE):
+    """Berechnet die gleiche Matrix p wie SchulzePoll.computeP.
+
+    Args:
+        d (Matrix von int): Die Matrix d
+        workers (int): Anzahl der Prozesse, None für die Anzahl der
+            Prozessoren. Bei 1 wird im aktuellen Prozess gerechnet.
+        blockSize (int): Kantenlänge einer Kachel
+    """
+    n = len(d)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    p = initialP(d)
+    if n == 0:
+        return []
+    numBlocks = (n + blockSize - 1) // blockSize
+    if workers <= 1 or numBlocks == 1:
+        for tasks in phases(numBlocks):
+            for bi, bj, bk in tasks:
+                updateBlock(p, n, blockSize, bi, bj, bk)
+        return toMatrix(p, n)
+    # vor dem Speicherbereich, siehe getPool
+    pool = getPool(workers)
+    shm = shared_memory.SharedMemory(create=True, size=len(p) * 8)
+    try:
+        view = shm.buf.cast('q')
+        try:
+            view[:] = p
+            try:
+                for tasks in phases(numBlocks):
+                    if len(tasks) == 1:
+                        # Diagonal-Kachel, lohnt nicht zu verteilen
+                        updateBlock(view, n, blockSize, *tasks[0])
+                    else:
+                        size = max(1, len(tasks) // (4 * workers))
+                        list(pool.map(workerUpdate, [
+                            (shm.name, n, blockSize, tasks[k:k + size])
+                            for k in range(0, len(tasks), size)]))
+            except BrokenProcessPool:
+                # abgestürzter Worker, beim nächsten Aufruf neu starten
+                _pool.pop(workers, None)
+                raise
+            p = array.array('q', view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+    return toMatrix(p, n)
+
+
+def randomD(n, seed=0):
+    rnd = random.Random(seed)
+    d = [[0] * n for i in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            a = rnd.randint(0, 1000)
+            d[i][j] = a
+            d[j][i] = 1000 - a
+    return d
+
+
+def benchmark(n=256, workerCounts=(1, 2, 4, 8), blockSize=DEFAULT_BLOCK_SIZE,
+              seed=0):
+    """Misst die Laufzeit von parallelComputeP für verschiedene
+    Anzahlen von Prozessen auf einer zufälligen Matrix d.
+
+    Gibt eine Liste von Tupeln (workers, Sekunden) zurück.
+    """
+    d = randomD(n, seed)
+    result = []
+    for workers in workerCounts:
+        start = time.perf_counter()
+        parallelComputeP(d, workers, blockSize)
+        result.append((workers, time.perf_counter() - start))
+    return result
+
+
+class SharedBallots(object):
+
+    """Legt die Stimmen mehrerer Abstimmungen in gemeinsamen
+    Speicherbereichen (multiprocessing.shared_memory) ab.
+
+    Pro Abstimmung gibt es einen Bereich: Für Schulze pro Stimme eine
+    Zeile (abgestimmt, Ranking) als int64, für Median die Beträge in Cent
+    als int64 mit ABSTENTION für Enthaltungen. Die Gewichte liegen in einem eigenen
+    Bereich, der von allen Abstimmungen mit den gleichen Gewichten
+    geteilt wird. Worker-Prozesse verbinden sich über descriptor() mit
+    den Bereichen, ohne die Stimmen zu kopieren.
+
+    Die Bereiche werden in close() (bzw. am Ende eines with-Blocks)
+    immer freigegeben, auch wenn ein Worker abgestürzt ist.
+    """
+
+    def __init__(self, polls):
+        """
+        Args:
+            polls (list<Poll>): MedianPoll und SchulzePoll Abstimmungen
+        """
+        self.segments = []
+        self.entries = []
+        try:
+            weightSegments = {}
+            for poll in polls:
+                weights = tuple(vote.weight for vote in poll.votes)
+                if weights not in weightSegments:
+                    weightSegments[weights] = self.create('q', weights)
+                if isinstance(poll, SchulzePoll):
+                    kind = 'schulze'
+                    data = self.schulzeRows(poll)
+                    segment = self.create('q', data)
+                elif isinstance(poll, MedianPoll):
+                    kind = 'median'
+                    data = [ABSTENTION if vote.value is None else vote.value
+                            for vote in poll.votes]
+                    segment = self.create('q', data)
+                else:
+                    raise ValueError('Unbekannter Abstimmungstyp %s' %
+                                     type(poll).__name__)
+                engines = None
+                if kind == 'schulze':
+                    engines = (poll.engine, poll.pEngine)
+                self.entries.append((kind, self.skel(poll), engines,
+                                     weightSegments[weights], segment,
+                                     len(poll.votes)))
+        except Exception:
+            self.close()
+            raise
+
+    def create(self, typecode, data):
+        data = array.array(typecode, data)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(1, len(data) * 8))
+        self.segments.append(shm)
+        view = shm.buf.cast(typecode)
+        try:
+            view[:len(data)] = data
+        finally:
+            view.release()
+        return shm.name
+
+    def schulzeRows(self, poll):
+        numOptions = len(poll.options)
+        empty = [0] * numOptions
+        for vote in poll.votes:
+            if vote.ranking is None:
+                yield 0
+                yield from empty
+            else:
+                if len(vote.ranking) != numOptions:
+                    raise MakeVoteException(
+                        'Falsche Anzahl an Abstimmungsgegenständen bei %s' %
+                        vote.name)
+                yield 1
+                yield from vote.ranking
+
+    def skel(self, poll):
+        if isinstance(poll, SchulzePoll):
+            skel = SchulzeSkel(poll.name, poll.percentRequired, poll.allVotes,
+                               poll.options)
+        else:
+            skel = MedianSkel(poll.name, poll.percentRequired, poll.allVotes,
+                              poll.maxValue)
+        return skel
+
+    def descriptor(self):
+        """Beschreibung der Bereiche, wird an die Worker übergeben."""
+        return list(self.entries)
+
+    def close(self):
+        for shm in self.segments:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attachBallots(descriptor):
+    _worker['ballots'] = descriptor
+    _worker['segments'] = {}
+
+
+def sharedView(name, typecode):
+    segments = _worker['segments']
+    if name not in segments:
+        shm = shared_memory.SharedMemory(name=name)
+        segments[name] = (shm, shm.buf.cast(typecode))
+    return segments[name][1]
+
+
+def sharedSchulzeChunks(weights, rows, numVoters, numOptions,
+                        chunkSize=stura_voting_chunked.DEFAULT_CHUNK_SIZE):
+    width = numOptions + 1
+    for start in range(0, numVoters, chunkSize):
+        chunk = []
+        for v in range(start, min(start + chunkSize, numVoters)):
+            ranking = None
+            if rows[v * width]:
+                ranking = rows[v * width + 1:(v + 1) * width].tolist()
+            chunk.append(SchulzeVote('', weights[v], ranking))
+        yield chunk
+
+
+def evaluateShared(index):
+    """Wertet die Abstimmung index im Worker-Prozess aus.
+
+    actualVotes ist im Ergebnis None, damit die Stimmen nicht zurück
+    übertragen werden.
+    """
+    kind, skel, engines, weightsName, dataName, numVoters = \
+        _worker['ballots'][index]
+    poll = skel.emptyPoll()
+    weights = sharedView(weightsName, 'q')
+    if kind == 'schulze':
+        poll.engine, poll.pEngine = engines
+        rows = sharedView(dataName, 'q')
+        chunks = sharedSchulzeChunks(weights, rows, numVoters,
+                                     len(poll.options))
+        result = stura_voting_chunked.evaluateSchulzeChunks(poll, chunks)
+        # p und ranks hier berechnen, nicht erst im Hauptprozess
+        return result.materialize()
+    # direkt aus den Bereichen, ohne MedianVote Objekte
+    values = sharedView(dataName, 'q')
+    return medianResultFromValues(
+        poll, ((None if value == ABSTENTION else value, weight)
+               for value, weight in zip(values[:numVoters],
+                                        weights[:numVoters])))
+
+
+def parallelEvaluate(polls, workers=None):
+    """Wertet mehrere Abstimmungen in mehreren Prozessen aus.
+
+    Die Stimmen werden einmal in gemeinsame Speicherbereiche geschrieben
+    (siehe SharedBallots), die Prozesse lesen sie dort ohne Kopie. Stürzt
+    ein Worker ab wird eine Exception geworfen, die Speicherbereiche
+    werden in jedem Fall freigegeben.
+
+    Gibt die Ergebnisse in der Reihenfolge von polls zurück, actualVotes
+    ist in den Ergebnissen None.
+    """
+    with SharedBallots(polls) as shared:
+        with ProcessPoolExecutor(workers, initializer=attachBallots,
+                                 initargs=(shared.descriptor(),)) as ex:
+            return list(ex.map(evaluateShared, range(len(polls))))
+
+
+if __name__ == '__main__':
+    print('Prozessoren: %d' % multiprocessing.cpu_count())
+    timings = benchmark()
+    base = timings[0][1]
+    for workers, seconds in timings:
+        print('%d Prozesse: %.2fs (Speedup %.2f)' %
+              (workers, seconds, base / seconds))
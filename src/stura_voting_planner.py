@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_planner.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Automatische Wahl der Verfahren für Schulze-Abstimmungen.
+
+Einmalig werden alle Verfahren aus SchulzePoll.dEngines und pEngines
+mit kleinen Beispielen gemessen (Kalibrierung), die Zeiten werden im
+Cache-Verzeichnis gespeichert. Danach wird für jede Abstimmung mit
+engine / pEngine 'auto' anhand der Anzahl der Optionen und Stimmen das
+voraussichtlich schnellste Verfahren gewählt. Die Wahl wird in
+instrumentation unter 'planner.d.<Verfahren>' bzw. 'planner.p.<...>'
+gezählt. Wer ein Verfahren fest setzen will, setzt engine bzw. pEngine
+der Abstimmung auf dessen Namen.
+
+Das parallele Verfahren für p wird nur bei mehreren Prozessoren
+gemessen und gewählt. Gemessen wird mit überwiegend verschiedenen
+Rankings, wie sie bei echten Abstimmungen mit vielen Stimmen auftreten,
+vor jeder Messung wird stura_voting.contributionCache geleert und der
+Prozess-Pool des parallelen Verfahrens vorher einmal gestartet.
+
+Nicht geplant werden MedianPoll (es gibt nur ein Verfahren) und
+optionale Bibliotheken wie numpy, die Verfahren in stura_voting
+verwenden sie nicht.
+
+Aufruf zum (erneuten) Kalibrieren:
+    python3 stura_voting_planner.py
+"""
+
+import json
+import logging
+import math
+import os
+import platform
+import random
+import time
+
+import stura_voting
+from stura_voting_cache import *
+
+
+logger = logging.getLogger('stura_voting_planner')
+
+CALIBRATION_VERSION = 2
+# Anzahl Optionen und Stimmen der Messungen für d
+D_OPTIONS = (2, 3, 4, 5, 7, 10, 15)
+D_BALLOTS = (200, 2000)
+# Anzahl Optionen der Messungen für p
+P_OPTIONS = (32, 96)
+# größtes Gewicht der Beispiele
+MAX_WEIGHT = 2000
+
+
+def calibrationKey():
+    """Die Messungen gelten nur für die gleiche Umgebung."""
+    return '%d-%s-%s-%d' % (CALIBRATION_VERSION,
+                            platform.python_implementation(),
+                            platform.python_version(), os.cpu_count() or 1)
+
+
+def syntheticVotes(n, numBallots, rnd):
+    """Zufällige Stimmen, jede mit eigenem Ranking und Gewicht bis
+    MAX_WEIGHT. Gleiche Rankings gibt es so nur bei wenigen Optionen und
+    fast jedes Gewicht kommt nur einmal vor, wie bei echten Abstimmungen
+    in denen jeder Fachbereich / jede Initiative ein eigenes Gewicht hat.
+    """
+    return [SchulzeVote('', rnd.randint(1, MAX_WEIGHT),
+                        [rnd.randint(0, n - 1) for _ in range(n)])
+            for _ in range(numBallots)]
+
+
+def measure(func, repeat=3, setup=None):
+    """Gibt die kürzeste Zeit von repeat Aufrufen zurück.
+
+    Args:
+        setup (function): Wird vor jedem Aufruf aufgerufen und nicht
+            mitgemessen
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        t = time.perf_counter() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+
+class EnginePlanner(object):
+
+    """Wählt anhand gemessener Zeiten die Verfahren für d und p."""
+
+    def __init__(self, path=None, timings=None):
+        """
+        Args:
+            path (string): Datei mit den gespeicherten Zeiten, None für
+                planner.json im Cache-Verzeichnis
+            timings (dict): Bereits bekannte Zeiten, dann wird nicht
+                kalibriert
+        """
+        if path is None:
+            path = os.path.join(defaultCacheDir(), 'planner.json')
+        self.path = path
+        self.timings = timings
+
+    def dEngineNames(self):
+        return sorted(e for e in SchulzePoll.dEngines if e != 'auto')
+
+    def pEngineNames(self):
+        names = sorted(e for e in SchulzePoll.pEngines if e != 'auto')
+        if (os.cpu_count() or 1) < 2:
+            names.remove('parallel')
+        return names
+
+    def calibrate(self, seed=0):
+        """Misst alle Verfahren, dauert einige Sekunden."""
+        rnd = random.Random(seed)
+        timings = {'key': calibrationKey(), 'd': {}, 'p': {}}
+        for n in D_OPTIONS:
+            poll = SchulzeSkel('', 0.5, True, list(range(n))).emptyPoll()
+            samples = [syntheticVotes(n, v, rnd) for v in D_BALLOTS]
+            for engine in self.dEngineNames():
+                func = getattr(poll, SchulzePoll.dEngines[engine])
+                timings['d'].setdefault(engine, {})[str(n)] = \
+                    [measure(lambda: func(votes),
+                             setup=stura_voting.contributionCache.clear)
+                     for votes in samples]
+        for n in P_OPTIONS:
+            poll = SchulzeSkel('', 0.5, True, list(range(n))).emptyPoll()
+            d = poll.computeD(syntheticVotes(n, 200, rnd))
+            for engine in self.pEngineNames():
+                func = getattr(poll, SchulzePoll.pEngines[engine])
+                # startet den Prozess-Pool, das passiert nur einmal
+                func(d)
+                timings['p'].setdefault(engine, {})[str(n)] = \
+                    measure(lambda: func(d), 1)
+        self.timings = timings
+        logger.info('Verfahren kalibriert: %s', timings)
+        return timings
+
+    def load(self):
+        """Lädt gespeicherte Zeiten, gibt False zurück falls keine
+        passenden vorhanden sind.
+        """
+        try:
+            with open(self.path) as f:
+                timings = json.load(f)
+        except (EnvironmentError, ValueError):
+            return False
+        if not isinstance(timings, dict) or \
+                timings.get('key') != calibrationKey():
+            return False
+        self.timings = timings
+        return True
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmpPath = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmpPath, 'w') as f:
+                json.dump(self.timings, f)
+            os.replace(tmpPath, self.path)
+        except EnvironmentError as e:
+            logger.warning('Zeiten nicht gespeichert: %s', e)
+
+    def ensureCalibrated(self):
+        if self.timings is None and not self.load():
+            self.calibrate()
+            self.save()
+
+    def estimateD(self, engine, n, numBallots):
+        """Schätzt die Zeit für d: linear in der Anzahl der Stimmen,
+        quadratisch in der Anzahl der Optionen.
+        """
+        byN = self.timings['d'].get(engine)
+        if not byN:
+            return math.inf
+        measured = sorted(int(k) for k in byN)
+        # nächste gemessene Anzahl Optionen, möglichst nicht kleiner
+        gridN = next((m for m in measured if m >= n), measured[-1])
+        small, large = byN[str(gridN)]
+        v0, v1 = D_BALLOTS
+        slope = max(large - small, 0) / (v1 - v0)
+        t = max(small + slope * (numBallots - v0), 0)
+        return t * (n / gridN) ** 2
+
+    def estimateP(self, engine, n):
+        """Schätzt die Zeit für p, kubisch in der Anzahl der Optionen."""
+        byN = self.timings['p'].get(engine)
+        if not byN:
+            return math.inf
+        measured = sorted(int(k) for k in byN)
+        gridN = next((m for m in measured if m >= n), measured[-1])
+        return byN[str(gridN)] * (n / gridN) ** 3
+
+    def chooseD(self, n, numBallots):
+        self.ensureCalibrated()
+        return min(self.dEngineNames(),
+                   key=lambda e: self.estimateD(e, n, numBallots))
+
+    def chooseP(self, n):
+        if n < P_OPTIONS[0]:
+            # Prozesse zu starten lohnt sich hier nie
+            return 'python'
+        self.ensureCalibrated()
+        return min(self.pEngineNames(), key=lambda e: self.estimateP(e, n))
+
+
+def installPlanner(planner=None):
+    """Verwendet den Planer für alle Abstimmungen mit 'auto'.
+
+    Args:
+        planner (EnginePlanner): None für einen Planer mit den Zeiten aus
+            dem Cache-Verzeichnis
+    """
+    if planner is None:
+        planner = EnginePlanner()
+    stura_voting.enginePlanner = planner
+    return planner
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    planner = EnginePlanner()
+    planner.calibrate()
+    planner.save()
+    for n in D_OPTIONS:
+        print('%d Optionen: d mit %s (100 Stimmen), %s (10000 Stimmen)' %
+              (n, planner.chooseD(n, 100), planner.chooseD(n, 10000)))
+    for n in P_OPTIONS:
+        print('%d Optionen: p mit %s' % (n, planner.chooseP(n)))
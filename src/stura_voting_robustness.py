@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_robustness.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Monte-Carlo Analyse wie stabil die Ergebnisse einer Sitzung sind.
+
+In jeder Stichprobe fehlen zufällig gewählte Abstimmende und die
+Gewichte der übrigen werden leicht verändert, danach werden alle
+Abstimmungen neu ausgewertet. Die Stichproben werden in Blöcken auf
+mehrere Prozesse verteilt, jeder Block hat einen eigenen festen Seed, das
+Ergebnis hängt also nicht von der Anzahl der Prozesse ab.
+
+Beispiel:
+    robustness = analyzeSession(polls, samples=2000)
+    pairs = []
+    for p, r, rob in zip(polls, results, robustness):
+        pairs.extend([(p, r), (p, rob)])
+    html = pollsToHtml(title, pairs)
+"""
+
+import math
+import multiprocessing
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from dominate.tags import *
+
+from stura_voting import *
+
+
+DEFAULT_BATCH_SIZE = 100
+
+# Zustand eines Worker-Prozesses, gesetzt von initWorker
+_worker = {}
+
+
+class SchulzeModel(object):
+
+    """Vorbereitete Form einer Schulze-Abstimmung: Abstimmende mit
+    gleichem Ranking werden zu Gruppen zusammengefasst, pro Stichprobe
+    werden nur die Gewichte pro Gruppe aufsummiert.
+    """
+
+    def __init__(self, poll, voterIndex):
+        self.skel = SchulzeSkel(poll.name, poll.percentRequired,
+                                poll.allVotes, poll.options)
+        self.voters = []
+        self.voterGroup = []
+        self.pairs = []
+        groups = {}
+        for vote in poll.votes:
+            vote = poll.actualVote(vote)
+            if vote is None:
+                continue
+            key = tuple(vote.ranking)
+            if key not in groups:
+                groups[key] = len(self.pairs)
+                n = len(key)
+                self.pairs.append([(i, j) for i in range(n) for j in range(n)
+                                   if key[i] < key[j]])
+            self.voters.append(voterIndex[vote.name])
+            self.voterGroup.append(groups[key])
+
+    def evaluate(self, weights):
+        """Gibt das Ranking für die Gewichte aller Abstimmenden zurück."""
+        numChoices = len(self.skel.options)
+        groupWeights = [0] * len(self.pairs)
+        weightSum = 0
+        for v, g in zip(self.voters, self.voterGroup):
+            groupWeights[g] += weights[v]
+            weightSum += weights[v]
+        d = [[0] * numChoices for i in range(numChoices)]
+        for pairs, w in zip(self.pairs, groupWeights):
+            if w:
+                for i, j in pairs:
+                    d[i][j] += w
+        r = self.skel.emptyPoll().resultFromD(None, weightSum, d)
+        return tuple(tuple(group) for group in r.ranks)
+
+
+class MedianModel(object):
+
+    """Vorbereitete Form einer Median-Abstimmung: Die Stimmen werden
+    einmal nach Betrag sortiert, pro Stichprobe wird nur noch aufsummiert.
+    """
+
+    def __init__(self, poll, voterIndex):
+        self.percentRequired = poll.percentRequired
+        entries = []
+        for vote in poll.votes:
+            value = vote.value
+            if value is None:
+                if not poll.allVotes:
+                    continue
+                value = 0
+            entries.append((value, voterIndex[vote.name]))
+        entries.sort(key=lambda e: e[0], reverse=True)
+        self.values = [e[0] for e in entries]
+        self.voters = [e[1] for e in entries]
+
+    def evaluate(self, weights):
+        ws = [weights[v] for v in self.voters]
+        required = math.floor(sum(ws) * self.percentRequired)
+        weightSoFar = 0
+        for value, w in zip(self.values, ws):
+            weightSoFar += w
+            if weightSoFar > required:
+                return value
+        return None
+
+
+class RobustnessResult(object):
+
+    """Verteilung der Ergebnisse einer Abstimmung über alle Stichproben.
+    """
+
+    def __init__(self, kind, baseline, counts, samples, absence, weightNoise):
+        """
+        Args:
+            kind (string): 'schulze' oder 'median'
+            baseline: Ergebnis ohne Änderungen (Ranking als Tupel von
+                Tupeln bzw. genehmigter Betrag)
+            counts (Counter): Wie oft welches Ergebnis aufgetreten ist
+        """
+        self.kind = kind
+        self.baseline = baseline
+        self.counts = counts
+        self.samples = samples
+        self.absence = absence
+        self.weightNoise = weightNoise
+
+    def stability(self):
+        """Anteil der Stichproben mit dem gleichen Ergebnis."""
+        if not self.samples:
+            return 1.0
+        return self.counts[self.baseline] / self.samples
+
+    def winnerStability(self):
+        """Anteil der Stichproben mit der gleichen ersten Gruppe."""
+        if not self.samples:
+            return 1.0
+        same = sum(c for ranks, c in self.counts.items()
+                   if ranks[:1] == self.baseline[:1])
+        return same / self.samples
+
+    def quantile(self, q):
+        """Quantil der genehmigten Beträge (None zählt als 0), None falls
+        es keine Stichproben gibt.
+        """
+        values = sorted((0 if v is None else v, c)
+                        for v, c in self.counts.items())
+        limit = q * self.samples
+        seen = 0
+        for value, c in values:
+            seen += c
+            if seen >= limit:
+                return value
+        return None
+
+    def htmlOutput(self, doc, poll):
+        with doc:
+            h3('Stabilität des Ergebnisses von "%s"' % poll.name)
+            div('%d Stichproben, in jeder fehlen Abstimmende mit '
+                'Wahrscheinlichkeit %.0f%% und Gewichte ändern sich um bis '
+                'zu %d.' % (self.samples, self.absence * 100,
+                            self.weightNoise))
+            div('Gleiches Ergebnis in %.2f%% der Stichproben.' %
+                (self.stability() * 100))
+            if self.kind == 'schulze':
+                div('Gleiche erste Gruppe in %.2f%% der Stichproben.' %
+                    (self.winnerStability() * 100))
+            elif self.samples:
+                div('Genehmigte Beträge: 5%%-Quantil %s€, Median %s€, '
+                    '95%%-Quantil %s€.' % (formatCents(self.quantile(0.05)),
+                                           formatCents(self.quantile(0.5)),
+                                           formatCents(self.quantile(0.95))))
+
+
+def buildModels(polls):
+    names = []
+    voterIndex = {}
+    weights = []
+    for poll in polls:
+        for vote in poll.votes:
+            if vote.name not in voterIndex:
+                voterIndex[vote.name] = len(names)
+                names.append(vote.name)
+                weights.append(vote.weight)
+    models = []
+    for poll in polls:
+        if isinstance(poll, SchulzePoll):
+            models.append(SchulzeModel(poll, voterIndex))
+        elif isinstance(poll, MedianPoll):
+            models.append(MedianModel(poll, voterIndex))
+        else:
+            raise ValueError('Unbekannter Abstimmungstyp %s' %
+                             type(poll).__name__)
+    return models, weights
+
+
+def initWorker(models, weights, absence, weightNoise, seed):
+    _worker['models'] = models
+    _worker['weights'] = weights
+    _worker['params'] = (absence, weightNoise, seed)
+
+
+def runBatch(task):
+    """Wertet einen Block von Stichproben aus, gibt pro Abstimmung einen
+    Counter der Ergebnisse zurück.
+    """
+    batch, size = task
+    models = _worker['models']
+    weights = _worker['weights']
+    absence, weightNoise, seed = _worker['params']
+    rnd = random.Random('%d:%d' % (seed, batch))
+    counts = [Counter() for m in models]
+    for _ in range(size):
+        sample = []
+        for w in weights:
+            if rnd.random() < absence:
+                sample.append(0)
+            elif weightNoise:
+                sample.append(max(0, w + rnd.randint(-weightNoise,
+                                                     weightNoise)))
+            else:
+                sample.append(w)
+        for model, c in zip(models, counts):
+            c[model.evaluate(sample)] += 1
+    return counts
+
+
+def analyzeSession(polls, samples=1000, absence=0.1, weightNoise=0, seed=0,
+                   workers=None, batchSize=DEFAULT_BATCH_SIZE):
+    """Analysiert wie stabil die Ergebnisse aller Abstimmungen sind.
+
+    Args:
+        polls (list<Poll>): Die Abstimmungen, z.B. von readTable
+        samples (int): Anzahl der Stichproben
+        absence (float): Wahrscheinlichkeit dass ein Abstimmender fehlt
+        weightNoise (int): Maximale Änderung eines Gewichts
+        seed (int): Startwert für den Zufallsgenerator
+        workers (int): Anzahl der Prozesse, None für die Anzahl der
+            Prozessoren, bei 1 wird im aktuellen Prozess gerechnet.
+
+    Returns:
+        Eine Liste von RobustnessResult in der Reihenfolge von polls.
+    """
+    models, weights = buildModels(polls)
+    tasks = []
+    for batch, start in enumerate(range(0, samples, batchSize)):
+        tasks.append((batch, min(batchSize, samples - start)))
+    initArgs = (models, weights, absence, weightNoise, seed)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(tasks) <= 1:
+        initWorker(*initArgs)
+        batches = [runBatch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=initWorker,
+                                 initargs=initArgs) as ex:
+            batches = list(ex.map(runBatch, tasks))
+    result = []
+    for i, (poll, model) in enumerate(zip(polls, models)):
+        counts = Counter()
+        for batch in batches:
+            counts.update(batch[i])
+        kind = 'schulze' if isinstance(poll, SchulzePoll) else 'median'
+        result.append(RobustnessResult(kind, model.evaluate(weights), counts,
+                                       samples, absence, weightNoise))
+    return result
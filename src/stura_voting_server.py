@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_server.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Kleiner HTTP Server (asyncio, nur Standardbibliothek) der den
+aktuellen Bericht einer Sitzung ausliefert.
+
+Die Dateien der Sitzung werden wie bei stura_voting_watch überwacht.
+HTML und JSON werden nur neu erzeugt wenn sich die Eingaben einer
+Abstimmung geändert haben, sonst werden die fertigen Bytes ausgeliefert.
+Clients bekommen ein ETag und bei passendem If-None-Match nur 304.
+
+Aufruf:
+    python3 stura_voting_server.py voters.csv polls.xml table.csv
+
+Danach ist der Bericht unter http://127.0.0.1:8080/ (HTML) und
+http://127.0.0.1:8080/report.json (JSON-Zeilen) erreichbar.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import logging
+
+from stura_voting_watch import *
+
+
+logger = logging.getLogger('stura_voting_server')
+
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'json': 'application/x-ndjson; charset=utf-8',
+}
+
+ROUTES = {
+    '/': 'html',
+    '/report.html': 'html',
+    '/report.json': 'json',
+}
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    503: 'Service Unavailable',
+}
+
+
+class ReportCache(object):
+
+    """Die fertig erzeugten Berichte zum aktuellen Stand der Sitzung.
+
+    state ist None oder ein Paar (ETag, Dictionary Format -> Bytes) und
+    wird immer als Ganzes ersetzt, Anfragen lesen es ohne Sperre.
+    """
+
+    def __init__(self, watcher):
+        """
+        Args:
+            watcher (SessionWatcher): Überwacht die Dateien der Sitzung
+        """
+        self.watcher = watcher
+        self.key = None
+        self.state = None
+
+    def refresh(self):
+        """Prüft die Dateien und erzeugt die Berichte neu, falls sich
+        Ergebnisse geändert haben.
+        """
+        self.watcher.check()
+        table = self.watcher.table
+        if table is None:
+            return
+        pairs = table.evaluate()
+        key = (self.watcher.title, tuple(table.fingerprints))
+        if key == self.key:
+            return
+        h = hashlib.sha1(self.watcher.title.encode('utf-8'))
+        for fingerprint in table.fingerprints:
+            h.update(fingerprint)
+        etag = '"%s"' % h.hexdigest()
+        html = str(pollsToHtml(self.watcher.title, pairs)).encode('utf-8')
+        out = io.StringIO()
+        writeResultsJSONLines(out, pairs)
+        self.state = (etag, {'html': html,
+                             'json': out.getvalue().encode('utf-8')})
+        self.key = key
+        logger.info('Bericht neu erzeugt, ETag %s', etag)
+
+
+def etagMatches(header, etag):
+    if header is None:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+
+class ReportServer(object):
+
+    """HTTP/1.1 Server für die Berichte aus einem ReportCache."""
+
+    def __init__(self, cache, host='127.0.0.1', port=8080, timeout=30.0):
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    async def refreshLoop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Einlesen und Auswerten blockiert, daher im Thread
+                await loop.run_in_executor(None, self.cache.refresh)
+            except Exception:
+                logger.exception('Fehler beim Aktualisieren')
+            await asyncio.sleep(self.cache.watcher.interval)
+
+    async def readRequest(self, reader):
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not line:
+            return None
+        headers = {}
+        while True:
+            h = await asyncio.wait_for(reader.readline(), self.timeout)
+            if h in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = h.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            return ('', '', 'HTTP/1.0', headers)
+        return tuple(parts) + (headers,)
+
+    def response(self, method, path, headers):
+        """Gibt (Status, Header, Body) für eine Anfrage zurück."""
+        if method not in ('GET', 'HEAD'):
+            return 405, {'Allow': 'GET, HEAD'}, b''
+        fmt = ROUTES.get(path.split('?', 1)[0])
+        if fmt is None:
+            return 404, {}, b''
+        state = self.cache.state
+        if state is None:
+            return 503, {'Retry-After': '1'}, b''
+        etag, bodies = state
+        extra = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etagMatches(headers.get('if-none-match'), etag):
+            return 304, extra, b''
+        extra['Content-Type'] = CONTENT_TYPES[fmt]
+        return 200, extra, bodies[fmt]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await self.readRequest(reader)
+                if request is None:
+                    break
+                method, path, version, headers = request
+                if not method:
+                    status, extra, body = 400, {}, b''
+                else:
+                    status, extra, body = self.response(method, path, headers)
+                keepAlive = version == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                lines = ['HTTP/1.1 %d %s' % (status, REASONS[status])]
+                for name, value in extra.items():
+                    lines.append('%s: %s' % (name, value))
+                lines.append('Content-Length: %d' % len(body))
+                lines.append('Connection: %s' %
+                             ('keep-alive' if keepAlive else 'close'))
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        refresher = asyncio.ensure_future(self.refreshLoop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Aktuellen Bericht einer Sitzung per HTTP ausliefern')
+    parser.add_argument('voters')
+    parser.add_argument('polls')
+    parser.add_argument('table')
+    parser.add_argument('--title', default='Abstimmungen StuRa')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--interval', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    watcher = SessionWatcher(args.voters, args.polls, args.table, None,
+                             args.title, args.interval)
+    server = ReportServer(ReportCache(watcher), args.host, args.port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
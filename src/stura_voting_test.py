@@ -155,3 +155,912 @@ def test_schulze_three():
                    [5, 0, 7, 5],
                    [5, 5, 0, 5],
                    [6, 5, 5, 0]]
+
+
+def test_median_curve():
+    votes = [MedianVote('A', 4, 200), MedianVote('B', 3, 1000),
+             MedianVote('C', 2, 700), MedianVote('D', 2, 500)]
+    p = MedianPoll(MedianSkel('Median Test', 0.5, True, 1000))
+    for v in votes:
+        p.addVote(v)
+    r = p.evaluate()
+    expected = [(0.0, 1000), (0.25, 1000), (0.5, 500), (2 / 3, 200),
+                (0.75, 200), (1.0, None)]
+    for percent, value in expected:
+        assert r.curve.acceptedValue(percent) == value
+    assert r.curve.steps() == [(0.0, 3 / 11, 1000), (3 / 11, 5 / 11, 700),
+                               (5 / 11, 7 / 11, 500), (7 / 11, 1.0, 200)]
+
+
+def test_schulze_condorcet_fast_path():
+    import random
+    rnd = random.Random(42)
+    fast = 0
+    for _ in range(200):
+        numOptions = rnd.randint(2, 6)
+        skel = SchulzeSkel('Schulze Test', 0.5, True,
+                           ['O%d' % i for i in range(numOptions)])
+        p = SchulzePoll(skel)
+        for v in range(rnd.randint(1, 5)):
+            ranking = [rnd.randint(0, 2) for _ in range(numOptions)]
+            p.addVote(SchulzeVote(str(v), rnd.randint(1, 3), ranking))
+        r = p.evaluate()
+        fullP = p.computeP(r.d)
+        assert r.p == fullP
+        assert r.ranks == p.rankP(fullP)
+        if p.majorityOrder(r.d) is not None:
+            fast += 1
+    assert fast > 0
+
+
+def test_schulze_top_groups():
+    # Beispiel 1 von Wikipedia, enthält einen Zyklus
+    options = ['A', 'B', 'C', 'D', 'E']
+    skel = SchulzeSkel('SchulzeTest', 0.5, True, options)
+    p = SchulzePoll(skel)
+    rankings = [(5, [0, 2, 1, 4, 3]), (5, [0, 4, 3, 1, 2]),
+                (8, [3, 0, 4, 2, 1]), (3, [1, 2, 0, 4, 3]),
+                (7, [1, 3, 0, 4, 2]), (2, [2, 1, 0, 3, 4]),
+                (7, [4, 3, 1, 0, 2]), (8, [2, 1, 4, 3, 0])]
+    for i, (w, ranking) in enumerate(rankings):
+        p.addVote(SchulzeVote(str(i), w, ranking))
+
+    winner = p.evaluate(topK=1)
+    assert winner.partial
+    assert winner.p is None
+    assert winner.ranks == [[4]]
+    assert p.evaluate(topK=3).ranks == [[4], [0], [2]]
+    assert not p.evaluate().partial
+
+
+def test_schulze_bitset():
+    import random
+    rnd = random.Random(7)
+    for _ in range(100):
+        numOptions = rnd.randint(1, 7)
+        skel = SchulzeSkel('Schulze Test', 0.5, True,
+                           ['O%d' % i for i in range(numOptions)])
+        p = SchulzePoll(skel)
+        maxWeight = rnd.choice([3, 5000])
+        for v in range(rnd.randint(0, 30)):
+            ranking = [rnd.randint(0, 9) for _ in range(numOptions)]
+            p.addVote(SchulzeVote(str(v), rnd.randint(0, maxWeight), ranking))
+        expected = p.evaluate()
+        for engine in ('bitset', 'histogram'):
+            p.engine = engine
+            r = p.evaluate()
+            assert r.d == expected.d == p.computeD(p.votes)
+            assert r.ranks == expected.ranks
+
+
+def test_schulze_auto_engine():
+    import random
+    import stura_voting
+    rnd = random.Random(5)
+
+    def poll(numOptions, numVotes, numRankings):
+        p = SchulzeSkel('Schulze Test', 0.5, True,
+                        ['O%d' % i for i in range(numOptions)]).emptyPoll()
+        rankings = [[rnd.randint(0, numOptions - 1)
+                     for _ in range(numOptions)] for _ in range(numRankings)]
+        for v in range(numVotes):
+            p.addVote(SchulzeVote(str(v), rnd.randint(1, 2000),
+                                  list(rnd.choice(rankings))))
+        return p
+
+    for p, engine in ((poll(9, 50, 50), 'python'),
+                      (poll(9, 300, 300), 'bitset'),
+                      (poll(5, 300, 300), 'bitset'),
+                      (poll(5, 300, 10), 'histogram')):
+        instrumentation.reset()
+        assert p.evaluate().d == p.computeD(p.votes)
+        assert instrumentation.get('planner.d.' + engine) == 1
+    p = poll(9, 300, 300)
+    size = len(stura_voting.contributionCache)
+    p.engine = 'histogram'
+    assert p.evaluate().d == p.computeD(p.votes)
+    # für mehr als HISTOGRAM_MAX_OPTIONS Optionen wird nichts gespeichert
+    assert len(stura_voting.contributionCache) == size
+
+
+def test_schulze_parallel_p():
+    import stura_voting_parallel
+    skel = SchulzeSkel('Schulze Test', 0.5, True, list(range(20)))
+    p = SchulzePoll(skel)
+    d = stura_voting_parallel.randomD(20, 3)
+    d[0][1] = d[1][0] = 500
+    expected = p.computeP(d)
+    for workers in (1, 2):
+        assert stura_voting_parallel.parallelComputeP(d, workers, 6) == \
+            expected
+    # die wiederverwendeten Prozesse halten den Speicherbereich nicht fest
+    for pid in stura_voting_parallel.getPool(2)._processes:
+        try:
+            with open('/proc/%d/maps' % pid) as f:
+                assert 'psm_' not in f.read()
+        except FileNotFoundError:
+            pass
+    p.pEngine = 'parallel'
+    assert p.computePWithEngine(d) == expected
+
+
+def test_parallel_evaluate_shared():
+    import random
+    from multiprocessing import shared_memory
+    import stura_voting_parallel
+    rnd = random.Random(5)
+    schulze = SchulzeSkel('Schulze', 0.5, True, ['A', 'B', 'Nein']).emptyPoll()
+    median = MedianSkel('Median', 0.5, False, 1000).emptyPoll()
+    allVotes = MedianSkel('Alle', 0.5, True, 1000).emptyPoll()
+    for v in range(50):
+        w = rnd.randint(1, 3)
+        ranking = [rnd.randint(0, 2) for _ in range(3)]
+        if rnd.random() < 0.2:
+            ranking = None
+        schulze.addVote(SchulzeVote(str(v), w, ranking))
+        value = rnd.randint(0, 1000)
+        if rnd.random() < 0.2:
+            value = None
+        median.addVote(MedianVote(str(v), w, value))
+        allVotes.addVote(MedianVote(str(v), w, value))
+    expected = [schulze.evaluate(), median.evaluate(), allVotes.evaluate()]
+    with stura_voting_parallel.SharedBallots([schulze, median]) as shared:
+        names = [shm.name for shm in shared.segments]
+    for name in names:
+        try:
+            shared_memory.SharedMemory(name=name).close()
+            assert False, 'Speicherbereich wurde nicht freigegeben'
+        except FileNotFoundError:
+            pass
+    results = stura_voting_parallel.parallelEvaluate(
+        [schulze, median, allVotes], 2)
+    assert results[0].d == expected[0].d
+    assert results[0].ranks == expected[0].ranks
+    for r, e in zip(results[1:], expected[1:]):
+        assert r.acceptedValue == e.acceptedValue
+        assert r.requiredVotes == e.requiredVotes
+        assert r.weightSum == e.weightSum
+        assert r.curve.steps() == e.curve.steps()
+        assert r.actualVotes is None
+
+
+def test_condorcet_methods():
+    # Beispiel 1 von Wikipedia, Schulze: E > A > C > B > D, Ranked Pairs
+    # legt C > E fest bevor E > A betrachtet wird: A > C > E > B > D
+    options = ['A', 'B', 'C', 'D', 'E']
+    p = SchulzePoll(SchulzeSkel('SchulzeTest', 0.5, True, options))
+    rankings = [(5, [0, 2, 1, 4, 3]), (5, [0, 4, 3, 1, 2]),
+                (8, [3, 0, 4, 2, 1]), (3, [1, 2, 0, 4, 3]),
+                (7, [1, 3, 0, 4, 2]), (2, [2, 1, 0, 3, 4]),
+                (7, [4, 3, 1, 0, 2]), (8, [2, 1, 4, 3, 0])]
+    for i, (w, ranking) in enumerate(rankings):
+        p.addVote(SchulzeVote(str(i), w, ranking))
+
+    results = dict(p.evaluateMethods())
+    assert sorted(results.keys()) == ['copeland', 'minimax', 'rankedpairs',
+                                      'schulze']
+    assert results['schulze'].ranks == [[4], [0], [2], [1], [3]]
+    assert results['rankedpairs'].ranks == [[0], [2], [4], [1], [3]]
+    assert results['copeland'].scores == [0, 0, 0, -2, 2]
+    assert results['minimax'].scores == [25, 29, 28, 33, 24]
+    assert results['minimax'].ranks[0] == [4]
+    for r in results.values():
+        assert r.d is results['schulze'].d
+
+
+def test_what_if_weights():
+    import random
+    import stura_voting_whatif
+    rnd = random.Random(13)
+    voters = [WeightedVote('V%d' % i, rnd.randint(1, 4)) for i in range(30)]
+    skels = [MedianSkel('Median', 0.5, True, 1000),
+             MedianSkel('Median 2/3', 2 / 3, False, 1000),
+             SchulzeSkel('Schulze', 0.5, True, ['A', 'B', 'C', 'Nein'])]
+    values = [[rnd.choice(['', '0', '100', '250,5', '1000']) for _ in voters],
+              [rnd.choice(['', '300', '700']) for _ in voters],
+              [rnd.choice(['', '0 1 2 3', '2 1 0 3', '1 1 0 2'])
+               for _ in voters]]
+
+    def makePolls():
+        polls = [s.emptyPoll() for s in skels]
+        for p, column in zip(polls, values):
+            for voter, val in zip(voters, column):
+                p.addVote(p.makeVote(voter, val))
+        return polls
+
+    session = stura_voting_whatif.WhatIfSession(makePolls())
+    for _ in range(20):
+        voter = rnd.choice(voters)
+        voter.weight = rnd.randint(0, 6)
+        session.setWeight(voter.name, voter.weight)
+        for (p, r), expected in zip(session.results(),
+                                    [p.evaluate() for p in makePolls()]):
+            assert r.weightSum == expected.weightSum
+            assert r.requiredVotes == expected.requiredVotes
+            if isinstance(p, MedianPoll):
+                assert r.acceptedValue == expected.acceptedValue
+            else:
+                assert r.d == expected.d
+                assert r.ranks == expected.ranks
+    assert session.setWeight('Unbekannt', 2) == []
+
+
+def test_incremental_table(tmp_path):
+    import pytest
+    import stura_voting_io
+    import stura_voting_incremental
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2),
+              WeightedVote('C', 3)]
+    skels = [MedianSkel('Median', 0.5, True, 1000),
+             SchulzeSkel('Schulze', 0.5, True, ['X', 'Nein'])]
+    path = str(tmp_path / 'table.csv')
+
+    def write(rows):
+        with open(path, 'w') as f:
+            f.write(';Median;Schulze\n')
+            for row in rows:
+                f.write(';'.join(row) + '\n')
+
+    def check(table):
+        expected = stura_voting_io.readTable(path, voters, skels)
+        for (p, r), e in zip(table.evaluate(), expected):
+            r2 = e.evaluate()
+            assert r.weightSum == r2.weightSum
+            if isinstance(e, MedianPoll):
+                assert r.acceptedValue == r2.acceptedValue
+            else:
+                assert r.d == r2.d
+
+    table = stura_voting_incremental.IncrementalTable(voters, skels)
+    write([['A', '100', '0 1'], ['B', '200', '1 0'], ['C', '', '']])
+    assert table.load(path) == [0, 1]
+    check(table)
+    assert table.load(path) == []
+    write([['A', '100', '0 1'], ['B', '300', '1 0'], ['C', '', '']])
+    assert table.load(path) == [0]
+    instrumentation.reset()
+    check(table)
+    assert instrumentation.get('incremental.evaluate') == 1
+    write([['A', '100', '0 1'], ['B', '300', '1 0']])
+    assert table.load(path) == [0, 1]
+    check(table)
+    # neue Spalten und ungültige Zelle: alter Stand bleibt erhalten
+    with open(path, 'w') as f:
+        f.write(';Schulze;Median\nA;0 1;100\nB;1 0 1;300\n')
+    with pytest.raises(MakeVoteException):
+        table.load(path)
+    write([['A', '100', '0 1'], ['B', '300', '1 0']])
+    assert table.head == ['Median', 'Schulze']
+    assert [r is not None for r in table.results] == [True, True]
+    assert table.load(path) == []
+    check(table)
+
+
+def test_schulze_lazy_result():
+    # Beispiel 1 von Wikipedia, enthält einen Zyklus
+    options = ['A', 'B', 'C', 'D', 'E']
+    p = SchulzePoll(SchulzeSkel('SchulzeTest', 0.5, True, options))
+    rankings = [(5, [0, 2, 1, 4, 3]), (5, [0, 4, 3, 1, 2]),
+                (8, [3, 0, 4, 2, 1]), (3, [1, 2, 0, 4, 3]),
+                (7, [1, 3, 0, 4, 2]), (2, [2, 1, 0, 3, 4]),
+                (7, [4, 3, 1, 0, 2]), (8, [2, 1, 4, 3, 0])]
+    for i, (w, ranking) in enumerate(rankings):
+        p.addVote(SchulzeVote(str(i), w, ranking))
+
+    instrumentation.reset()
+    r = p.evaluate()
+    assert r.d[0] == [0, 20, 26, 30, 22]
+    assert instrumentation.get('schulze.closure') == 0
+    r.releaseP = True
+    assert r.ranks == [[4], [0], [2], [1], [3]]
+    assert instrumentation.get('schulze.closure') == 1
+    assert r._p is None
+    assert r.p[0] == [0, 28, 28, 30, 24]
+    assert r.materialize() is r
+    assert instrumentation.get('schulze.closure') == 2
+
+
+def test_median_cents():
+    assert parseCents('250') == 25000
+    assert parseCents('250,5') == 25050
+    assert parseCents('1.234,56 €') == 123456
+    assert parseCentsColumn(['0,01', '', '12.000']) == [1, None, 1200000]
+    for invalid in ('250.5', '1,234', '12,345', 'abc', '-5'):
+        try:
+            parseCents(invalid)
+            assert False, invalid
+        except ValueError:
+            pass
+    assert decimalToCents('1000.0') == 100000
+    assert formatCents(123456) == '1234.56'
+
+    # 0,1 + 0,2 ist als float nicht exakt 0,3
+    skel = MedianSkel('Median Test', 0.5, False, 30)
+    p = MedianPoll(skel)
+    for name, val in (('A', '0,3'), ('B', '0,1'), ('C', '0,3')):
+        p.addVote(p.makeVote(WeightedVote(name, 1), val))
+    assert p.evaluate().acceptedValue == 30
+
+
+def test_median_batch():
+    import random
+    rnd = random.Random(17)
+    voters = [WeightedVote('V%d' % i, rnd.randint(1, 5)) for i in range(40)]
+    polls = []
+    for i in range(6):
+        skel = MedianSkel('Antrag %d' % i, rnd.choice([0.5, 2 / 3, 0.75]),
+                          rnd.random() < 0.5, 100000)
+        p = skel.emptyPoll()
+        for v in voters:
+            val = rnd.choice(['', '0', '10', '99,99', '500', '1.000'])
+            p.addVote(p.makeVote(v, val))
+        polls.append(p)
+    polls.append(MedianSkel('Leer', 0.5, False, 100).emptyPoll())
+    for p, r in zip(polls, evaluateMedianBatch(polls)):
+        expected = p.evaluate()
+        assert r.acceptedValue == expected.acceptedValue
+        assert r.requiredVotes == expected.requiredVotes
+        assert r.weightSum == expected.weightSum
+        assert r.curve.steps() == expected.curve.steps()
+
+
+def test_ingest_service():
+    import asyncio
+    import stura_voting_ingest
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2)]
+    polls = [MedianSkel('Median', 0.5, True, 1000).emptyPoll(),
+             SchulzeSkel('Schulze', 0.5, True, ['X', 'Nein']).emptyPoll()]
+    service = stura_voting_ingest.IngestService(voters, polls)
+
+    async def run():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'A;Median;10\nB;Schulze;0 1\nA;Median;20\n'
+                     b'C;Median;1\nA;Schulze;0\nB;Median;\n')
+        writer.write_eof()
+        answers = (await reader.read()).decode().split('\n')
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    answers = asyncio.run(run())
+    assert [a.split(' ')[0] for a in answers[:-1]] == \
+        ['OK', 'OK', 'ERR', 'ERR', 'ERR', 'OK']
+    assert [(v.name, v.value) for v in polls[0].votes] == \
+        [('A', 1000), ('B', None)]
+    assert [v.ranking for v in polls[1].votes] == [[0, 1]]
+
+
+def test_ingest_service_errors():
+    import asyncio
+    import stura_voting_ingest
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2)]
+    polls = [MedianSkel('Median', 0.5, True, 1000).emptyPoll(),
+             SchulzeSkel('Schulze', 0.5, True, ['X', 'Nein']).emptyPoll()]
+    service = stura_voting_ingest.IngestService(voters, polls)
+    addVote = polls[0].addVote
+
+    def failingAddVote(vote):
+        if vote.name == 'B':
+            raise OSError('Platte voll')
+        addVote(vote)
+
+    async def send(port, data):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        writer.write_eof()
+        answers = (await reader.read()).decode().split('\n')
+        writer.close()
+        return [a.split(' ')[0] for a in answers[:-1]]
+
+    class FailingLog(object):
+
+        def append(self, poll, vote):
+            pass
+
+        def maybeCompact(self):
+            pass
+
+        def commit(self):
+            raise OSError('fsync failed')
+
+    async def run():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        polls[0].addVote = failingAddVote
+        first = await send(port, b'A;Median;10\nB;Median;20\n'
+                                 b'B;Schulze;0 1\n')
+        polls[0].addVote = addVote
+        second = await send(port, b'B;Median;20\nB;Schulze;0 1\n')
+        polls[1].log = FailingLog()
+        third = await send(port, b'A;Schulze;1 0\nA;Schulze;1 0\n')
+        server.close()
+        await server.wait_closed()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == ['OK', 'ERR', 'ERR']
+    assert second == ['OK', 'OK']
+    # gezählt aber nicht dauerhaft, eine Wiederholung wird abgelehnt
+    assert third == ['WARN', 'ERR']
+    assert [(v.name, v.value) for v in polls[0].votes] == \
+        [('A', 1000), ('B', 2000)]
+    assert [v.name for v in polls[1].votes] == ['B', 'A']
+    assert service.accepted == 4
+
+
+def test_ballot_log(tmp_path):
+    import time
+    import stura_voting_wal
+    path = str(tmp_path / 'votes.log')
+    skels = [MedianSkel('Median', 0.5, True, 1000),
+             SchulzeSkel('Schulze', 0.5, True, ['X', 'Y', 'Nein'])]
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2),
+              WeightedVote('C', 3)]
+
+    def votes(polls):
+        return [[(v.name, v.weight, getattr(v, 'value', None),
+                  getattr(v, 'ranking', None)) for v in p.votes]
+                for p in polls]
+
+    log, polls = stura_voting_wal.BallotLog.open(path, skels)
+    for v, m, s in zip(voters, ['10', '', '2,5'], ['0 1 2', '', '1 1 0']):
+        polls[0].addVote(polls[0].makeVote(v, m))
+        polls[1].addVote(polls[1].makeVote(v, s))
+    log.close()
+    expected = votes(polls)
+    # unvollständiger Eintrag am Ende
+    with open(path, 'ab') as f:
+        f.write(b'\x20\x00\x00\x00\x01')
+    log, polls = stura_voting_wal.BallotLog.open(path, skels)
+    assert votes(polls) == expected
+    log.compact()
+    log.clear(polls[1])
+    polls[1].addVote(polls[1].makeVote(voters[0], '2 1 0'))
+    log.close()
+    expected = votes(polls)
+    log, polls = stura_voting_wal.BallotLog.open(path, skels)
+    assert votes(polls) == expected
+    assert expected[1] == [('A', 1, None, [2, 1, 0])]
+    log.close()
+    # ohne weitere Stimmen wird nach groupDelay gespeichert
+    log, polls = stura_voting_wal.BallotLog.open(path, skels,
+                                                 groupDelay=0.01)
+    polls[0].addVote(polls[0].makeVote(voters[1], '5'))
+    for _ in range(200):
+        if log.pending == 0:
+            break
+        time.sleep(0.01)
+    assert log.pending == 0
+    assert stura_voting_wal.recoverPolls(path, skels)[0][0].votes[-1].value \
+        == 500
+    log.close()
+
+
+def test_ballot_log_compact_after(tmp_path):
+    import stura_voting_wal
+    path = str(tmp_path / 'votes.log')
+    skels = [MedianSkel('Median', 0.5, True, 1000)]
+    voters = [WeightedVote('V%d' % i, 1) for i in range(5)]
+    log, polls = stura_voting_wal.BallotLog.open(path, skels, compactAfter=3)
+    for v in voters:
+        polls[0].addVote(polls[0].makeVote(v, '1'))
+    log.close()
+    recovered = stura_voting_wal.recoverPolls(path, skels)[0]
+    assert [v.name for v in recovered[0].votes] == \
+        ['V0', 'V1', 'V2', 'V3', 'V4']
+    log, polls = stura_voting_wal.BallotLog.open(path, skels, compactAfter=3)
+    polls[0].addVote(polls[0].makeVote(WeightedVote('A', 1), '1'))
+    log.clear(polls[0])
+    assert polls[0].votes == []
+    log.close()
+    assert stura_voting_wal.recoverPolls(path, skels)[0][0].votes == []
+
+
+def test_parse_cache(tmp_path):
+    import os
+    import stura_voting_io
+    import stura_voting_cache
+    votersPath = str(tmp_path / 'voters.csv')
+    pollsPath = str(tmp_path / 'polls.xml')
+    with open(votersPath, 'w') as f:
+        f.write('A;1\nB;2\n')
+    skels = [MedianSkel('Median', 0.5, True, 1000),
+             SchulzeSkel('Schulze', 2 / 3, False, ['X', 'Nein'])]
+    stura_voting_io.writePollsToXML(pollsPath, skels)
+    cache = stura_voting_cache.ParseCache(str(tmp_path / 'cache'))
+    for _ in range(2):
+        voters = cache.parseVoters(votersPath)
+        polls = cache.parsePolls(pollsPath)
+        assert [(v.name, v.weight) for v in voters] == [('A', 1), ('B', 2)]
+        assert [stura_voting_cache.encodeSkel(s) for s in polls] == \
+            [stura_voting_cache.encodeSkel(s) for s in skels]
+    assert (cache.hits, cache.misses) == (2, 2)
+    with open(votersPath, 'w') as f:
+        f.write('A;1\nB;3\n')
+    assert cache.parseVoters(votersPath)[1].weight == 3
+    assert cache.misses == 3
+    cache.maxSize = 0
+    cache.evict()
+    assert os.listdir(str(tmp_path / 'cache')) == []
+
+
+def test_npz_ballots(tmp_path):
+    import pytest
+    pytest.importorskip('numpy')
+    import stura_voting_npz
+    path = str(tmp_path / 'session.npz')
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2),
+              WeightedVote('C', 3)]
+    skels = [MedianSkel('Median', 0.5, True, 1000),
+             SchulzeSkel('Schulze', 0.5, False, ['X', 'Y', 'Nein'])]
+    polls = [s.emptyPoll() for s in skels]
+    for v, m, s in zip(voters, ['10', '', '2,5'], ['0 1 2', '', '1 1 0']):
+        polls[0].addVote(polls[0].makeVote(v, m))
+        polls[1].addVote(polls[1].makeVote(v, s))
+    stura_voting_npz.exportNPZ(path, voters, polls)
+    for mmap in (False, True):
+        ballots = stura_voting_npz.ArrayBallots.load(path, mmap)
+        for (p, r), poll in zip(ballots.evaluate(), polls):
+            expected = poll.evaluate()
+            assert r.weightSum == expected.weightSum
+            if isinstance(poll, MedianPoll):
+                assert r.acceptedValue == expected.acceptedValue
+            else:
+                assert r.d == expected.d
+                assert r.ranks == expected.ranks
+        assert [v.value for v in ballots.toPolls()[0].votes] == \
+            [1000, None, 250]
+
+
+def test_ranking_code():
+    import itertools
+    for n in range(5):
+        codes = set()
+        for ranking in itertools.product(range(n), repeat=n):
+            ranking = list(ranking)
+            code = encodeRanking(ranking)
+            decoded = decodeRanking(code, n)
+            assert encodeRanking(decoded) == code
+            for i in range(n):
+                for j in range(n):
+                    assert (ranking[i] < ranking[j]) == \
+                        (decoded[i] < decoded[j])
+            assert rankingFromBytes(rankingToBytes(ranking), n) == decoded
+            codes.add(code)
+        # Anzahl schwacher Ordnungen auf n Elementen
+        assert len(codes) == [1, 1, 3, 13, 75][n]
+    assert decodeRanking(encodeRanking([3, 0, 7, 0]), 4) == [1, 0, 2, 0]
+    votes = [SchulzeVote('A', 1, [0, 1]), SchulzeVote('B', 2, [0, 5]),
+             SchulzeVote('C', 4, [1, 1])]
+    assert groupRankings(votes) == {encodeRanking([0, 1]): 3,
+                                    encodeRanking([0, 0]): 4}
+
+
+def test_engine_planner(tmp_path):
+    import stura_voting
+    import stura_voting_planner
+    timings = {'key': stura_voting_planner.calibrationKey(),
+               'd': {'python': {'3': [1.0, 1.0]},
+                     'bitset': {'3': [0.5, 2.0]},
+                     'histogram': {'3': [2.0, 2.0]}},
+               'p': {'python': {'32': 1.0}}}
+    planner = stura_voting_planner.EnginePlanner(
+        str(tmp_path / 'planner.json'), timings)
+    assert planner.chooseD(3, 200) == 'bitset'
+    assert planner.chooseD(3, 5000) == 'python'
+    assert planner.chooseP(64) == 'python'
+    planner.save()
+    loaded = stura_voting_planner.EnginePlanner(planner.path)
+    assert loaded.load() and loaded.timings == timings
+    skel = SchulzeSkel('Schulze', 0.5, True, ['X', 'Y', 'Nein'])
+    p = skel.emptyPoll()
+    for v in range(300):
+        p.addVote(SchulzeVote(str(v), 1, [v % 3, (v + 1) % 3, 2]))
+    instrumentation.reset()
+    stura_voting_planner.installPlanner(planner)
+    try:
+        expected = p.computeD(p.votes)
+        assert p.evaluate().d == expected
+        assert instrumentation.get('planner.d.bitset') == 1
+        p.engine = 'histogram'
+        assert p.evaluate().d == expected
+        assert instrumentation.get('planner.d.histogram') == 0
+    finally:
+        stura_voting.enginePlanner = None
+
+
+def test_engine_planner_calibrate(tmp_path, monkeypatch):
+    import random
+    import stura_voting_planner
+    monkeypatch.setattr(stura_voting_planner, 'D_OPTIONS', (3, 7))
+    monkeypatch.setattr(stura_voting_planner, 'D_BALLOTS', (200, 1000))
+    monkeypatch.setattr(stura_voting_planner, 'P_OPTIONS', (32,))
+    planner = stura_voting_planner.EnginePlanner(
+        str(tmp_path / 'planner.json'))
+    timings = planner.calibrate()
+    assert sorted(timings['d']) == planner.dEngineNames()
+    assert sorted(timings['p']) == planner.pEngineNames()
+    for byN in timings['d'].values():
+        assert sorted(byN) == ['3', '7']
+        assert all(len(t) == 2 and min(t) > 0 for t in byN.values())
+    assert planner.chooseD(7, 5000) in planner.dEngineNames()
+    votes = stura_voting_planner.syntheticVotes(7, 1000, random.Random(3))
+    assert len(set(v.weight for v in votes)) > 500
+    calls = []
+    stura_voting_planner.measure(lambda: calls.append('run'), 2,
+                                 setup=lambda: calls.append('setup'))
+    assert calls == ['setup', 'run', 'setup', 'run']
+    monkeypatch.undo()
+    # Zeiten wie bei Gewichten 1 bis 2000 gemessen: computeD ist bei
+    # wenigen Stimmen schneller, danach die Bitmasken
+    planner = stura_voting_planner.EnginePlanner(
+        str(tmp_path / 'fixed.json'),
+        {'key': stura_voting_planner.calibrationKey(),
+         'd': {'python': {'7': [0.6, 9.0]}, 'bitset': {'7': [0.75, 6.0]},
+               'histogram': {'7': [2.0, 21.0]}},
+         'p': {'python': {'32': 1.0}}})
+    assert planner.chooseD(7, 100) == 'python'
+    assert planner.chooseD(7, 2000) == 'bitset'
+    assert planner.chooseD(10, 500) == 'bitset'
+
+
+def randomChunkedSchulze(numVoters):
+    import random
+    rnd = random.Random(11)
+    skel = SchulzeSkel('Schulze Test', 0.5, True, ['A', 'B', 'C', 'Nein'])
+    voters = [WeightedVote('V%d' % i, rnd.randint(1, 4))
+              for i in range(numVoters)]
+    poll = skel.emptyPoll()
+    for v in voters:
+        ranking = None
+        if rnd.random() > 0.2:
+            ranking = [rnd.randint(0, 3) for _ in skel.options]
+        poll.addVote(SchulzeVote(v.name, v.weight, ranking))
+    return skel, voters, poll
+
+
+def test_chunked_binary(tmp_path):
+    import stura_voting_chunked
+    skel, voters, poll = randomChunkedSchulze(257)
+    expected = poll.evaluate()
+    path = str(tmp_path / 'ballots.bin')
+    stura_voting_chunked.writeSchulzeBinary(path, poll.votes,
+                                            len(skel.options))
+    assert stura_voting_chunked.binaryInfo(path) == (4, 257)
+    seen = []
+    r = stura_voting_chunked.evaluateSchulzeBinary(
+        skel.emptyPoll(), path, chunkSize=50,
+        progress=lambda done, total: seen.append(done))
+    assert seen == [50, 100, 150, 200, 250, 257]
+    assert r.d == expected.d
+    assert r.p == expected.p
+    assert r.ranks == expected.ranks
+    assert r.weightSum == expected.weightSum
+
+
+def test_chunked_csv(tmp_path):
+    import stura_voting_chunked
+    skel, voters, poll = randomChunkedSchulze(100)
+    expected = poll.evaluate()
+    path = str(tmp_path / 'table.csv')
+    with open(path, 'w') as f:
+        f.write(';%s\n' % skel.name)
+        for vote in poll.votes:
+            ranking = ''
+            if vote.ranking is not None:
+                ranking = ' '.join(str(x) for x in vote.ranking)
+            f.write('%s;%s\n' % (vote.name, ranking))
+    r = stura_voting_chunked.evaluateSchulzeCSV(skel.emptyPoll(), path,
+                                                voters, chunkSize=7)
+    assert r.d == expected.d
+    assert r.ranks == expected.ranks
+
+
+def test_robustness():
+    import stura_voting_io
+    import stura_voting_robustness
+    voters = [WeightedVote('V%d' % i, 1 + i % 3) for i in range(12)]
+    median = MedianSkel('Median', 0.5, True, 100000).emptyPoll()
+    schulze = SchulzeSkel('Schulze', 0.5, True, ['X', 'Y', 'Nein']).emptyPoll()
+    for i, v in enumerate(voters):
+        median.addVote(median.makeVote(v, str(10 * (i % 4))))
+        schulze.addVote(schulze.makeVote(v, '%d %d 2' % (i % 2, 1 - i % 2)))
+    polls = [median, schulze]
+    single = stura_voting_robustness.analyzeSession(
+        polls, samples=250, absence=0.2, weightNoise=1, workers=1,
+        batchSize=50)
+    multi = stura_voting_robustness.analyzeSession(
+        polls, samples=250, absence=0.2, weightNoise=1, workers=2,
+        batchSize=50)
+    for a, b in zip(single, multi):
+        assert a.counts == b.counts
+        assert sum(a.counts.values()) == 250
+    assert 0 <= single[0].quantile(0.05) <= single[0].quantile(0.95)
+    empty = stura_voting_robustness.analyzeSession(polls, samples=0,
+                                                   workers=1)
+    assert empty[0].quantile(0.5) is None
+    for results in (single, empty):
+        pairs = list(zip(polls, results))
+        html = str(stura_voting_io.pollsToHtml('Test', pairs))
+        assert 'Stabilität des Ergebnisses von &quot;Median&quot;' in html
+
+
+def test_session_watcher(tmp_path):
+    import os
+    import stura_voting_io
+    import stura_voting_watch
+    votersPath = str(tmp_path / 'voters.csv')
+    pollsPath = str(tmp_path / 'polls.xml')
+    tablePath = str(tmp_path / 'table.csv')
+    outputPath = str(tmp_path / 'report.html')
+    with open(votersPath, 'w') as f:
+        f.write('A;1\nB;2\n')
+    stura_voting_io.writePollsToXML(
+        pollsPath, [MedianSkel('Median', 0.5, True, 100000),
+                    SchulzeSkel('Schulze', 0.5, True, ['X', 'Nein'])])
+    with open(tablePath, 'w') as f:
+        f.write(';Median;Schulze\nA;10;0 1\nB;20;1 0\n')
+    watcher = stura_voting_watch.SessionWatcher(
+        votersPath, pollsPath, tablePath, outputPath, 'Test', debounce=0.5)
+    instrumentation.reset()
+    # zuerst nur gesehen, eingelesen erst nach debounce
+    assert not watcher.check(now=0)
+    assert not watcher.check(now=0.2)
+    assert not os.path.exists(outputPath)
+    assert watcher.check(now=0.6)
+    assert os.path.exists(outputPath)
+    assert instrumentation.get('incremental.evaluate') == 2
+    assert not watcher.check(now=5)
+    # nur die Median-Spalte ändert sich
+    with open(tablePath, 'w') as f:
+        f.write(';Median;Schulze\nA;100;0 1\nB;20;1 0\n')
+    assert not watcher.check(now=10)
+    assert watcher.check(now=11)
+    assert instrumentation.get('incremental.evaluate') == 3
+    results = watcher.table.evaluate()
+    assert results[0][1].acceptedValue == 2000
+    # ungültige Tabelle: alter Bericht bleibt
+    with open(tablePath, 'w') as f:
+        f.write(';Median;Schulze\nA;abc;0 1\nB;20;1 0\n')
+    assert not watcher.check(now=20)
+    assert not watcher.check(now=21)
+    assert watcher.error is not None
+    assert watcher.table.evaluate()[0][1].acceptedValue == 2000
+
+
+def test_archive(tmp_path):
+    import stura_voting_archive
+    voters = [WeightedVote('A', 1), WeightedVote('B', 2),
+              WeightedVote('C', 3)]
+    skels = [MedianSkel('Klein', 0.5, True, 5000),
+             MedianSkel('Groß', 0.5, False, 200000),
+             SchulzeSkel('Schulze', 0.5, True, ['X', 'Y', 'Nein'])]
+    polls = [s.emptyPoll() for s in skels]
+    rows = [('A', '10', '', '0 1 2'), ('B', '', '1000', ''),
+            ('C', '20', '', '2 1 0')]
+    for name, *cells in rows:
+        voter = [v for v in voters if v.name == name][0]
+        for p, val in zip(polls, cells):
+            p.addVote(p.makeVote(voter, val))
+    results = [p.evaluate() for p in polls]
+    archive = stura_voting_archive.Archive(str(tmp_path / 'archive.db'))
+    sessionId = archive.ingest('Sitzung 1', voters, polls, results,
+                               '2015-06-01')
+    assert archive.sessions() == [(sessionId, 'Sitzung 1', '2015-06-01')]
+    loadedVoters, loaded = archive.load(sessionId)
+    assert [(v.name, v.weight) for v in loadedVoters] == \
+        [('A', 1), ('B', 2), ('C', 3)]
+    for p, q, r in zip(loaded, polls, results):
+        assert p.name == q.name
+        e = p.evaluate()
+        assert e.weightSum == r.weightSum
+        if isinstance(p, MedianPoll):
+            assert [v.value for v in p.votes] == [v.value for v in q.votes]
+            assert e.acceptedValue == r.acceptedValue
+        else:
+            assert p.options == q.options
+            assert e.d == r.d and e.ranks == r.ranks
+    stored = archive.loadResults(sessionId)
+    assert stored['Schulze'][4] == results[2].d
+    assert stored['Klein'][2] == results[0].acceptedValue
+    assert archive.medianPollsAbstained('B') == \
+        [('Sitzung 1', 'Klein', 5000)]
+    assert archive.medianPollsAbstained('A') == \
+        [('Sitzung 1', 'Groß', 200000)]
+    assert archive.medianPollsAbstained('A', minValue=300000) == []
+    archive.close()
+
+
+def test_json_lines():
+    import io
+    import json
+    import stura_voting_io
+    voter = WeightedVote('A', 2)
+    median = MedianSkel('Median', 0.5, True, 100000).emptyPoll()
+    median.addVote(median.makeVote(voter, '12,5'))
+    schulze = SchulzeSkel('Schulze', 0.5, True, ['X', 'Y', 'Nein']).emptyPoll()
+    schulze.addVote(schulze.makeVote(voter, '0 1 2'))
+    full = schulze.evaluate()
+    partial = schulze.evaluate(topK=1)
+    pairs = [(median, median.evaluate()), (schulze, full),
+             (schulze, partial)]
+    for includeP in (False, True):
+        out = io.StringIO()
+        stura_voting_io.writeResultsJSONLines(out, pairs, includeP)
+        lines = [json.loads(l) for l in out.getvalue().splitlines()]
+        assert lines[0] == {'type': 'median', 'name': 'Median',
+                            'maxValue': 100000, 'requiredVotes': 1,
+                            'weightSum': 2, 'acceptedValue': 1250}
+        for line, r in zip(lines[1:], (full, partial)):
+            assert line['type'] == 'schulze'
+            assert line['n'] == 3
+            assert line['partial'] == r.partial
+            assert line['ranks'] == r.ranks
+            assert line['d'] == [x for row in r.d for x in row]
+        assert lines[1]['ranks'] == [[0], [1], [2]]
+        assert lines[2]['partial'] and lines[2]['ranks'] == [[0]]
+        if includeP:
+            assert lines[1]['p'] == [x for row in full.p for x in row]
+        else:
+            assert 'p' not in lines[1]
+        # partielle Ergebnisse haben kein p
+        assert 'p' not in lines[2]
+
+
+def test_report_server(tmp_path):
+    import asyncio
+    import stura_voting_io
+    import stura_voting_server
+    votersPath = str(tmp_path / 'voters.csv')
+    pollsPath = str(tmp_path / 'polls.xml')
+    tablePath = str(tmp_path / 'table.csv')
+    with open(votersPath, 'w') as f:
+        f.write('A;1\nB;2\n')
+    stura_voting_io.writePollsToXML(
+        pollsPath, [SchulzeSkel('Schulze', 0.5, True, ['X', 'Nein'])])
+    with open(tablePath, 'w') as f:
+        f.write(';Schulze\nA;0 1\nB;1 0\n')
+    watcher = stura_voting_server.SessionWatcher(
+        votersPath, pollsPath, tablePath, None, 'Test', debounce=0)
+    cache = stura_voting_server.ReportCache(watcher)
+    server = stura_voting_server.ReportServer(cache)
+
+    async def request(port, path, headers=''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('GET %s HTTP/1.1\r\nHost: x\r\n%s'
+                      'Connection: close\r\n\r\n' %
+                      (path, headers)).encode())
+        data = await reader.read()
+        writer.close()
+        head, _, body = data.partition(b'\r\n\r\n')
+        lines = head.decode().split('\r\n')
+        status = int(lines[0].split(' ')[1])
+        fields = dict(l.split(': ', 1) for l in lines[1:])
+        return status, fields, body
+
+    async def run():
+        s = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = s.sockets[0].getsockname()[1]
+        try:
+            assert (await request(port, '/'))[0] == 503
+            cache.refresh()
+            cache.refresh()
+            status, fields, body = await request(port, '/report.json')
+            assert status == 200
+            assert b'"name": "Schulze"' in body
+            etag = fields['ETag']
+            status, _, body = await request(port, '/',
+                                            'If-None-Match: %s\r\n' % etag)
+            assert (status, body) == (304, b'')
+            assert (await request(port, '/x'))[0] == 404
+            # unveränderte Eingaben: gleiches ETag
+            cache.refresh()
+            assert cache.state[0] == etag
+        finally:
+            s.close()
+            await s.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_wal.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Write-Ahead-Log für Stimmen.
+
+Jede mit addVote hinzugefügte Stimme wird an eine Binärdatei angehängt,
+nach einem Absturz werden die Abstimmungen aus dieser Datei wieder
+hergestellt.
+
+Dateiformat: Header '<4sIQ' (Magic, Version, Generation), danach
+Einträge aus Länge und CRC32 ('<II') gefolgt von den Daten. Die Daten
+beginnen mit '<BHH' (Art, Index der Abstimmung, Länge des Namens) und
+dem Namen, bei einer Stimme folgt ein Teil fester Länge: '<qBq' für
+Median (Gewicht, abgestimmt, Betrag in Cent) und '<qB(n)i' für Schulze
+(Gewicht, abgestimmt, Rangfolge). Die Art ENTRY_CLEAR löscht alle
+Stimmen einer Abstimmung.
+Ein unvollständiger oder beschädigter Eintrag am Ende (Absturz beim
+Schreiben) wird beim Einlesen abgeschnitten.
+
+Beim Kompaktieren werden alle aktuellen Stimmen in einen Snapshot
+(Generation g+1) geschrieben und danach ein leeres Log
+mit Generation g+1 angelegt. Ein Log wird nur auf einen Snapshot mit
+gleicher Generation angewendet, ein Absturz zwischen beiden Schritten
+führt also nicht zu doppelten Stimmen.
+Der Snapshot speichert spaltenweise pro Abstimmung: '<II' (Anzahl
+Stimmen, Länge der Namen), die Namen getrennt durch '\\0' und die
+Teile fester Länge hintereinander. Am Ende steht eine CRC32 über alles
+davor. So wird er ohne eine Python-Schleife pro Eintrag gelesen.
+
+Nur die Wiederherstellung aus dem Snapshot ist deutlich schneller als
+die Tabelle neu einzulesen (etwa 3x bei 40000 Stimmen). Das Abspielen
+des Logs braucht eine Python-Schleife pro Eintrag und ist etwa so
+schnell wie das Einlesen der CSV-Datei. Für eine schnelle
+Wiederherstellung sollte das Log daher regelmäßig kompaktiert werden
+(compactAfter), damit nur wenige Einträge abgespielt werden müssen.
+"""
+
+import os
+import struct
+import threading
+import zlib
+
+from stura_voting import *
+
+
+LOG_MAGIC = b'SVWL'
+SNAPSHOT_MAGIC = b'SVWS'
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<4sIQ')
+RECORD_HEADER = struct.Struct('<II')
+# Art, Index der Abstimmung, Länge des Namens
+ENTRY_HEAD = struct.Struct('<BHH')
+# RECORD_HEADER und ENTRY_HEAD zusammen, zum Lesen
+RECORD_PREFIX = struct.Struct('<IIBHH')
+MEDIAN_TAIL = struct.Struct('<qBq')
+# Anzahl Stimmen, Länge der Namen in Bytes
+SNAPSHOT_POLL = struct.Struct('<II')
+SNAPSHOT_CRC = struct.Struct('<I')
+
+ENTRY_VOTE = 1
+ENTRY_CLEAR = 2
+
+
+class BallotLogException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def voteTail(poll):
+    """Gibt das Struct für den Teil fester Länge einer Stimme zurück."""
+    if isinstance(poll, MedianPoll):
+        return MEDIAN_TAIL
+    return struct.Struct('<qB%di' % len(poll.options))
+
+
+def frame(kind, index, name=b'', tail=b''):
+    payload = ENTRY_HEAD.pack(kind, index, len(name)) + name + tail
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encodeVote(index, poll, vote, tail):
+    name = vote.name.encode('utf-8')
+    if isinstance(poll, MedianPoll):
+        value = vote.value
+        data = tail.pack(vote.weight, value is not None,
+                         0 if value is None else value)
+    elif vote.ranking is None:
+        data = tail.pack(vote.weight, False, *([0] * len(poll.options)))
+    else:
+        data = tail.pack(vote.weight, True, *vote.ranking)
+    return frame(ENTRY_VOTE, index, name, data)
+
+
+def readHeader(data, magic, path):
+    if len(data) < LOG_HEADER.size:
+        raise BallotLogException('%s ist unvollständig' % path)
+    m, version, generation = LOG_HEADER.unpack_from(data)
+    if m != magic or version != LOG_VERSION:
+        raise BallotLogException('%s ist kein gültiges Stimm-Log' % path)
+    return generation
+
+
+def replayInto(data, offset, polls):
+    """Wendet die Einträge aus data ab offset auf die Abstimmungen an.
+
+    Returns:
+        (int, int): Ende des gültigen Teils in Bytes, Anzahl Einträge
+    """
+    count = 0
+    end = len(data)
+    tails = [voteTail(p) for p in polls]
+    medians = [isinstance(p, MedianPoll) for p in polls]
+    appends = [p.votes.append for p in polls]
+    view = memoryview(data)
+    crc32 = zlib.crc32
+    unpackHead = RECORD_PREFIX.unpack_from
+    headSize = RECORD_PREFIX.size
+    while offset + headSize <= end:
+        length, crc, kind, index, nameLength = unpackHead(data, offset)
+        start = offset + RECORD_HEADER.size
+        stop = start + length
+        if stop > end or crc32(view[start:stop]) != crc:
+            break
+        if index >= len(polls):
+            raise BallotLogException('Unbekannte Abstimmung %d im Log' % index)
+        if kind == ENTRY_CLEAR:
+            polls[index].votes = []
+            appends[index] = polls[index].votes.append
+        else:
+            pos = offset + headSize
+            name = data[pos:pos + nameLength].decode('utf-8')
+            values = tails[index].unpack_from(data, pos + nameLength)
+            if medians[index]:
+                appends[index](MedianVote(
+                    name, values[0], values[2] if values[1] else None))
+            else:
+                appends[index](SchulzeVote(
+                    name, values[0], list(values[2:]) if values[1] else None))
+        offset = stop
+        count += 1
+    return offset, count
+
+
+def snapshotPath(path):
+    return path + '.snapshot'
+
+
+def writeSnapshot(f, polls, tails, generation):
+    parts = [LOG_HEADER.pack(SNAPSHOT_MAGIC, LOG_VERSION, generation)]
+    for poll, tail in zip(polls, tails):
+        names = '\0'.join(v.name for v in poll.votes).encode('utf-8')
+        parts.append(SNAPSHOT_POLL.pack(len(poll.votes), len(names)))
+        parts.append(names)
+        if isinstance(poll, MedianPoll):
+            parts.extend(tail.pack(v.weight, v.value is not None,
+                                   0 if v.value is None else v.value)
+                         for v in poll.votes)
+        else:
+            empty = [0] * len(poll.options)
+            parts.extend(tail.pack(v.weight, v.ranking is not None,
+                                   *(empty if v.ranking is None
+                                     else v.ranking))
+                         for v in poll.votes)
+    data = b''.join(parts)
+    f.write(data)
+    f.write(SNAPSHOT_CRC.pack(zlib.crc32(data)))
+
+
+def readSnapshot(path, polls):
+    """Liest einen Snapshot in die (leeren) Abstimmungen ein und gibt die
+    Generation zurück.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    generation = readHeader(data, SNAPSHOT_MAGIC, path)
+    end = len(data) - SNAPSHOT_CRC.size
+    if end < LOG_HEADER.size or \
+            SNAPSHOT_CRC.unpack_from(data, end)[0] != \
+            zlib.crc32(memoryview(data)[:end]):
+        raise BallotLogException('%s ist beschädigt' % path)
+    pos = LOG_HEADER.size
+    for poll in polls:
+        count, namesLength = SNAPSHOT_POLL.unpack_from(data, pos)
+        pos += SNAPSHOT_POLL.size
+        names = data[pos:pos + namesLength].decode('utf-8').split('\0') \
+            if count else []
+        pos += namesLength
+        tail = voteTail(poll)
+        block = data[pos:pos + count * tail.size]
+        pos += count * tail.size
+        if isinstance(poll, MedianPoll):
+            poll.votes = [MedianVote(n, w, v if voted else None)
+                          for n, (w, voted, v)
+                          in zip(names, tail.iter_unpack(block))]
+        else:
+            poll.votes = [SchulzeVote(n, t[0], list(t[2:]) if t[1] else None)
+                          for n, t in zip(names, tail.iter_unpack(block))]
+    if pos != end:
+        raise BallotLogException('%s ist beschädigt' % path)
+    return generation
+
+
+def recoverPolls(path, skels):
+    """Stellt die Abstimmungen aus Snapshot und Log wieder her.
+
+    Args:
+        path (string): Pfad des Logs
+        skels (list<PollSkel>): Die Abstimmungen der Sitzung, in der
+            gleichen Reihenfolge wie beim Schreiben.
+
+    Returns:
+        (list<Poll>, int, int, int): Die Abstimmungen, Generation, Länge
+            des gültigen Teils des Logs (inklusive Header, None falls das
+            Log nicht verwendet werden kann) und Anzahl der Einträge im Log
+    """
+    polls = [s.emptyPoll() for s in skels]
+    generation = 0
+    snap = snapshotPath(path)
+    if os.path.exists(snap):
+        generation = readSnapshot(snap, polls)
+    if not os.path.exists(path):
+        return polls, generation, None, 0
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < LOG_HEADER.size:
+        # Absturz beim Anlegen des Logs
+        return polls, generation, None, 0
+    if readHeader(data, LOG_MAGIC, path) != generation:
+        # altes Log aus der Zeit vor dem Snapshot
+        return polls, generation, None, 0
+    length, count = replayInto(data, LOG_HEADER.size, polls)
+    return polls, generation, length, count
+
+
+class BallotLog(object):
+
+    """Hängt die Stimmen der Abstimmungen an ein Log an.
+
+    Solange das Log offen ist schreibt addVote jeder Abstimmung in das
+    Log. Geschrieben wird gepuffert, fsync wird für mehrere Stimmen
+    gemeinsam aufgerufen (Group Commit): nach groupSize Einträgen, spätestens
+    aber groupDelay Sekunden nach dem ältesten noch nicht gespeicherten
+    Eintrag (über einen Timer-Thread, auch wenn keine weiteren Stimmen
+    kommen). commit erzwingt das Speichern aller bisherigen Einträge,
+    wer bestätigen will dass eine Stimme sicher gespeichert ist muss
+    commit aufrufen.
+    """
+
+    def __init__(self, path, polls, generation=0, length=None, records=0,
+                 groupSize=64, groupDelay=0.05, compactAfter=None):
+        """
+        Args:
+            path (string): Pfad des Logs
+            polls (list<Poll>): Die Abstimmungen, der Index in dieser
+                Liste wird im Log gespeichert
+            generation (int): Generation des Snapshots
+            length (int): Länge des gültigen Teils eines bestehenden Logs,
+                None falls ein neues Log angelegt werden soll
+            records (int): Anzahl der Einträge im bestehenden Log
+            compactAfter (int): Kompaktiert automatisch sobald das Log
+                so viele Einträge hat, None für nie
+        """
+        self.path = path
+        self.polls = polls
+        self.indices = {id(p): i for i, p in enumerate(polls)}
+        self.tails = [voteTail(p) for p in polls]
+        self.generation = generation
+        self.groupSize = groupSize
+        self.groupDelay = groupDelay
+        self.compactAfter = compactAfter
+        self.records = records
+        self.pending = 0
+        self.timer = None
+        # write und commit können aus dem Timer-Thread kommen
+        self.lock = threading.RLock()
+        if length is None:
+            self.f = self.createLog()
+        else:
+            self.f = open(path, 'r+b')
+            # beschädigten Rest abschneiden
+            self.f.truncate(length)
+            self.f.seek(length)
+        for p in polls:
+            p.log = self
+
+    @classmethod
+    def open(cls, path, skels, **kwargs):
+        """Stellt die Abstimmungen wieder her und öffnet das Log zum
+        Weiterschreiben.
+
+        Returns:
+            (BallotLog, list<Poll>)
+        """
+        polls, generation, length, records = recoverPolls(path, skels)
+        return cls(path, polls, generation, length, records, **kwargs), polls
+
+    def createLog(self):
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, self.generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+        self.records = 0
+        return open(self.path, 'ab')
+
+    def write(self, record):
+        with self.lock:
+            self.f.write(record)
+            self.records += 1
+            self.pending += 1
+            if self.pending >= self.groupSize:
+                self.commit()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.groupDelay, self.deadline)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def maybeCompact(self):
+        """Kompaktiert falls das Log compactAfter Einträge hat. Darf erst
+        aufgerufen werden wenn die Änderung auch in den Abstimmungen
+        steht, sonst fehlt sie im Snapshot.
+        """
+        with self.lock:
+            if self.compactAfter is not None and \
+                    self.records >= self.compactAfter:
+                self.compactLocked()
+
+    def deadline(self):
+        with self.lock:
+            self.timer = None
+            if self.pending and not self.f.closed:
+                self.commit()
+
+    def append(self, poll, vote):
+        index = self.indices[id(poll)]
+        self.write(encodeVote(index, poll, vote, self.tails[index]))
+
+    def clear(self, poll):
+        """Löscht alle Stimmen einer Abstimmung, z.B. bevor die Tabelle
+        neu eingelesen wird.
+        """
+        with self.lock:
+            self.write(frame(ENTRY_CLEAR, self.indices[id(poll)]))
+            poll.votes = []
+            self.maybeCompact()
+
+    def commit(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.pending = 0
+
+    def compact(self):
+        """Schreibt alle aktuellen Stimmen in einen neuen Snapshot und
+        beginnt ein leeres Log.
+        """
+        with self.lock:
+            self.compactLocked()
+
+    def compactLocked(self):
+        self.commit()
+        generation = self.generation + 1
+        snap = snapshotPath(self.path)
+        tmpPath = snap + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            writeSnapshot(f, self.polls, self.tails, generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, snap)
+        self.f.close()
+        self.generation = generation
+        self.f = self.createLog()
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.f.close()
+        for p in self.polls:
+            p.log = None
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# stura_voting_watch.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Automatische Auswertung sobald sich die Dateien einer Sitzung ändern.
+
+Abstimmende (CSV), Abstimmungen (XML) und Stimmtabelle (CSV) werden
+regelmäßig über Änderungszeit und Größe geprüft. Nach einer Änderung
+wird gewartet bis die Datei eine Weile unverändert ist, dann wird nur
+neu eingelesen was sich geändert hat und nur die betroffenen
+Abstimmungen werden neu ausgewertet (siehe IncrementalTable).
+
+Aufruf:
+    python3 stura_voting_watch.py voters.csv polls.xml table.csv out.html
+"""
+
+import argparse
+import logging
+import os
+import time
+from xml.parsers.expat import ExpatError
+
+from stura_voting_incremental import *
+
+
+logger = logging.getLogger('stura_voting_watch')
+
+
+def fileSignature(path):
+    """(Änderungszeit, Größe) einer Datei, None falls sie fehlt."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def skelKey(skel):
+    return (type(skel).__name__, skel.name, skel.percentRequired,
+            skel.allVotes, getattr(skel, 'options', None),
+            getattr(skel, 'maxValue', None))
+
+
+class SessionWatcher(object):
+
+    """Überwacht die Dateien einer Sitzung und erzeugt bei Änderungen
+    den HTML-Bericht neu.
+    """
+
+    def __init__(self, votersPath, pollsPath, tablePath, outputPath, title,
+                 interval=1.0, debounce=0.5, delimiter=';'):
+        """
+        Args:
+            outputPath (string): Hierhin wird der Bericht geschrieben,
+                None falls keine Datei geschrieben werden soll
+            interval (float): Sekunden zwischen zwei Prüfungen
+            debounce (float): So lange muss eine Datei unverändert sein
+                bevor sie eingelesen wird
+        """
+        self.paths = (votersPath, pollsPath, tablePath)
+        self.outputPath = outputPath
+        self.title = title
+        self.interval = interval
+        self.debounce = debounce
+        self.delimiter = delimiter
+        # zuletzt eingelesener Stand
+        self.loaded = (None, None, None)
+        # zuletzt gesehener Stand und seit wann er unverändert ist
+        self.seen = None
+        self.seenSince = None
+        self.voters = None
+        self.skels = None
+        self.table = None
+        self.error = None
+
+    def check(self, now=None):
+        """Prüft einmal die Dateien, gibt True zurück falls der Bericht
+        neu erzeugt wurde.
+        """
+        if now is None:
+            now = time.monotonic()
+        current = tuple(fileSignature(p) for p in self.paths)
+        if current != self.seen:
+            self.seen = current
+            self.seenSince = now
+            return False
+        if current == self.loaded or now - self.seenSince < self.debounce:
+            return False
+        if None in current:
+            return False
+        return self.refresh(current)
+
+    def refresh(self, signatures):
+        votersPath, pollsPath, tablePath = self.paths
+        try:
+            voters, skels = self.voters, self.skels
+            if signatures[0] != self.loaded[0]:
+                voters = parseVoters(votersPath, self.delimiter)
+            if signatures[1] != self.loaded[1]:
+                skels = parsePolls(pollsPath)
+            votersChanged = self.voters is None or \
+                [(v.name, v.weight) for v in voters] != \
+                [(v.name, v.weight) for v in self.voters]
+            skelsChanged = self.skels is None or \
+                [skelKey(s) for s in skels] != \
+                [skelKey(s) for s in self.skels]
+            table = self.table
+            if votersChanged or skelsChanged:
+                cache = None if table is None else table.cache
+                table = IncrementalTable(voters, skels, self.delimiter, cache)
+            changed = table.load(tablePath)
+        except (VoterParseException, PollParseException, MakeVoteException,
+                ExpatError, EnvironmentError) as e:
+            # alten Bericht behalten bis die Dateien wieder gültig sind
+            self.error = str(e)
+            self.loaded = signatures
+            logger.warning('Fehler beim Einlesen: %s', e)
+            return False
+        self.error = None
+        self.loaded = signatures
+        newTable = table is not self.table
+        self.voters, self.skels, self.table = voters, skels, table
+        if not changed and not newTable:
+            return False
+        self.writeReport()
+        logger.info('Bericht aktualisiert, geänderte Abstimmungen: %s',
+                    changed)
+        return True
+
+    def writeReport(self):
+        if self.outputPath is None:
+            return
+        html = str(self.table.html(self.title))
+        tmpPath = self.outputPath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(html)
+        # Bericht immer vollständig ersetzen, nie halb geschrieben
+        os.replace(tmpPath, self.outputPath)
+
+    def run(self, stop=None):
+        """Prüft die Dateien bis stop() True zurückgibt.
+
+        Args:
+            stop (function): Ohne Argumente, None für Endlosschleife
+        """
+        while stop is None or not stop():
+            self.check()
+            time.sleep(self.interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sitzung überwachen und automatisch auswerten')
+    parser.add_argument('voters')
+    parser.add_argument('polls')
+    parser.add_argument('table')
+    parser.add_argument('output')
+    parser.add_argument('--title', default='Abstimmungen StuRa')
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--debounce', type=float, default=0.5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    watcher = SessionWatcher(args.voters, args.polls, args.table, args.output,
+                             args.title, args.interval, args.debounce)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+# stura_voting_whatif.py
+#
+# Copyright (C) 2015 Fabian Wenzelmann <fabianwenzelmann(at)posteo.de>
+#
+# This file is part of stura-voting.
+#
+# stura-voting is free software: you
+# can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+#
+# stura-voting is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with stura-voting.
+#
+# If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Was-wäre-wenn Auswertungen für geänderte Stimmgewichte.
+
+Für jede Abstimmung wird der Beitrag jedes Abstimmenden getrennt
+gehalten, so dass die Änderung eines Gewichts als Differenz angewendet
+werden kann: Bei Schulze wird d in O(n²) angepasst, bei Median ein
+Fenwick-Baum über die Beträge in O(log V). Neu ausgewertet werden nur
+die Abstimmungen, in denen der Abstimmende eine Stimme hat.
+"""
+
+import math
+
+from stura_voting import *
+
+
+class WeightTree(object):
+
+    """Fenwick-Baum über die Gewichte der (absteigend sortierten)
+    Beträge einer Median-Abstimmung.
+
+    Bietet die gleichen Methoden wie MedianCurve und kann daher als curve
+    in einem MedianResult verwendet werden.
+    """
+
+    def __init__(self, values):
+        """
+        Args:
+            values (list<int>): Alle vorkommenden Beträge in Cent
+        """
+        self.values = sorted(set(values), reverse=True)
+        self.index = {v: i for i, v in enumerate(self.values)}
+        self.tree = [0] * (len(self.values) + 1)
+        self.weightSum = 0
+        self.step = 1
+        while self.step * 2 <= len(self.values):
+            self.step *= 2
+
+    def add(self, value, delta):
+        """Addiert delta zum Gewicht von value, O(log V)."""
+        self.weightSum += delta
+        i = self.index[value] + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def requiredVotes(self, percentRequired):
+        return math.floor(self.weightSum * percentRequired)
+
+    def acceptedValue(self, percentRequired):
+        """Wie MedianCurve.acceptedValue, O(log V)."""
+        required = self.requiredVotes(percentRequired)
+        # größte Position deren Präfixsumme höchstens required ist
+        pos = 0
+        rest = required
+        step = self.step
+        while step > 0:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= rest:
+                pos = nxt
+                rest -= self.tree[nxt]
+            step //= 2
+        if pos >= len(self.values):
+            return None
+        return self.values[pos]
+
+    def prefix(self, i):
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def steps(self):
+        """Wie MedianCurve.steps, ohne Beträge mit Gewicht 0."""
+        result = []
+        if self.weightSum <= 0:
+            return result
+        before = 0
+        for i, value in enumerate(self.values):
+            cum = self.prefix(i + 1)
+            if cum > before:
+                result.append((before / self.weightSum, cum / self.weightSum,
+                               value))
+            before = cum
+        return result
+
+
+class MedianWhatIf(object):
+
+    """Zerlegte Form einer Median-Abstimmung."""
+
+    def __init__(self, poll):
+        self.poll = poll
+        self.entries = {}
+        for vote in poll.votes:
+            value = vote.value
+            if value is None:
+                if not poll.allVotes:
+                    continue
+                value = 0
+            self.entries[vote.name] = [value, vote.weight]
+        self.tree = WeightTree([value for value, _ in self.entries.values()])
+        for value, weight in self.entries.values():
+            self.tree.add(value, weight)
+        self.result = None
+
+    def setWeight(self, name, weight):
+        """Setzt das Gewicht eines Abstimmenden.
+
+        Gibt True zurück falls sich die Abstimmung dadurch ändert.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry[1] == weight:
+            return False
+        self.tree.add(entry[0], weight - entry[1])
+        entry[1] = weight
+        self.result = None
+        return True
+
+    def evaluate(self):
+        """Gibt das Ergebnis zurück, actualVotes ist dabei None."""
+        if self.result is None:
+            tree = self.tree
+            self.result = MedianResult(
+                None, tree.requiredVotes(self.poll.percentRequired),
+                tree.weightSum, tree.acceptedValue(self.poll.percentRequired),
+                tree)
+        return self.result
+
+
+class SchulzeWhatIf(object):
+
+    """Zerlegte Form einer Schulze-Abstimmung."""
+
+    def __init__(self, poll):
+        self.poll = poll
+        self.votes = {}
+        actualVotes = []
+        self.weightSum = 0
+        for vote in poll.votes:
+            vote = poll.actualVote(vote)
+            if vote is not None:
+                vote = SchulzeVote(vote.name, vote.weight, vote.ranking)
+                self.votes[vote.name] = vote
+                actualVotes.append(vote)
+                self.weightSum += vote.weight
+        self.actualVotes = actualVotes
+        self.d = poll.computeDWithEngine(actualVotes)
+        self.result = None
+
+    def setWeight(self, name, weight):
+        """Setzt das Gewicht eines Abstimmenden, d wird in O(n²) um die
+        Differenz angepasst.
+
+        Gibt True zurück falls sich die Abstimmung dadurch ändert.
+        """
+        vote = self.votes.get(name)
+        if vote is None or vote.weight == weight:
+            return False
+        delta = weight - vote.weight
+        ranking = vote.ranking
+        d = self.d
+        numChoices = len(ranking)
+        for i in range(numChoices):
+            for j in range(i + 1, numChoices):
+                if ranking[i] < ranking[j]:
+                    d[i][j] += delta
+                elif ranking[j] < ranking[i]:
+                    d[j][i] += delta
+        vote.weight = weight
+        self.weightSum += delta
+        self.result = None
+        return True
+
+    def evaluate(self):
+        if self.result is None:
+            # d wird weiter verändert, das Ergebnis bekommt eine Kopie
+            d = [row[:] for row in self.d]
+            self.result = self.poll.resultFromD(list(self.actualVotes),
+                                                self.weightSum, d)
+        return self.result
+
+
+class WhatIfSession(object):
+
+    """Was-wäre-wenn Auswertung einer ganzen Sitzung.
+
+    Beispiel:
+        session = WhatIfSession(readTable(path, voters, skels))
+        affected = session.setWeight('Fachbereich Informatik', 3)
+        html = pollsToHtml(title, session.results())
+    """
+
+    def __init__(self, polls):
+        """
+        Args:
+            polls (list<Poll>): Die Abstimmungen, z.B. von readTable
+        """
+        self.polls = polls
+        self.trackers = []
+        for poll in polls:
+            if isinstance(poll, SchulzePoll):
+                self.trackers.append(SchulzeWhatIf(poll))
+            elif isinstance(poll, MedianPoll):
+                self.trackers.append(MedianWhatIf(poll))
+            else:
+                raise ValueError('Unbekannter Abstimmungstyp %s' %
+                                 type(poll).__name__)
+
+    def setWeight(self, name, weight):
+        """Ändert das Gewicht eines Abstimmenden in allen Abstimmungen.
+
+        Gibt die Indizes der Abstimmungen zurück, die sich geändert
+        haben. Nur diese werden beim nächsten Aufruf von results neu
+        ausgewertet.
+        """
+        if weight < 0:
+            raise ValueError('Gewicht muss mindestens 0 sein')
+        affected = []
+        for i, tracker in enumerate(self.trackers):
+            if tracker.setWeight(name, weight):
+                affected.append(i)
+        return affected
+
+    def results(self):
+        """Gibt Paare (Abstimmung, Ergebnis) wie für pollsToHtml zurück."""
+        return [(poll, tracker.evaluate())
+                for poll, tracker in zip(self.polls, self.trackers)]